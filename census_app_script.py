@@ -1,81 +1,165 @@
 # Import initial modules needed for data wrangling
-import requests
+import time
 import pandas as pd
 import numpy as np
 
-# Import data viz modules
-import altair as alt
-import plotly.express as px
+# Import Census API, data wrangling, and local store helpers
+from census_fetch import GEOGRAPHY_LEVELS, fetch_geography
+from census_data import VARIABLES, build_census_df
+from census_store import FIGURE_DIR, available_levels, available_years, load_columns, read_manifest, store_version
+
+# Import the shared dataset used by every session (loaded once, refreshed in the background)
+from census_serve import shared_dataset
+
+# Import level of detail helpers (rollups and sampling of county and tract data)
+from census_lod import rollup
+
+# Import figure helpers (builds the plotly and altair figures)
+from census_figures import SCATTER_VARS, FigureCache
+
+# Import statistics helpers (regressions and correlations)
+from census_stats import describe_relationship, relationship_stats
+
+# Import profiling hooks (per-rerun timings shown in the sidebar when CENSUS_PROFILE=1)
+from census_bench import PROFILE, timed
 
 # Import streamlit
 import streamlit as st
 
-# Request data from 2020 5 year ACS estimates at state level
-r = requests.get("https://api.census.gov/data/2020/acs/acs5",
-                params = {
-                    "get":"NAME,B01001_001E,B19058_002E,B19058_003E,B17020I_002E,B06009_002E,B06009_003E,B06009_004E,B06009_005E,B06009_006E,B08137_003E,B25081_002E,B02001_003E,B03001_003E,B02001_004E,B27011_008E,B27011_013E",
-                    "for":"state:*",
-                })
+# Time each step of this rerun when profiling is on
+rerun_start = time.perf_counter()
+timings = [] if PROFILE else None
+
+# Without the local store, the 2020 data is requested from the API (served from the local cache when possible) and
+# cleaned once per process. Every session shares that one copy: sessions starting at the same time wait for a single
+# fetch, and a background thread refreshes the data and swaps in the new version without blocking anyone.
+def shared_census_data():
+    return shared_dataset("acs5-2020-state", lambda: build_census_df(fetch_geography("state", 2020, list(VARIABLES), stream=True)))
+
+# What the local store holds (its manifest, years, and geography levels), read once per version of the store and shared by all sessions
+@st.cache_resource
+def store_index(store_version):
+    years = available_years("state")
+    return read_manifest(), years, {year: available_levels(year) for year in years}
+
+manifest, years, stored_levels = store_index(store_version())
+
+# Read the ACS 5 year estimates at state level from the local store if it has been built with census_store.py, letting
+# the user pick any stored year without a network call. Otherwise use the shared copy of the 2020 data, with
+# percentages, state codes, and regions added.
+if years:
+    year = st.sidebar.selectbox("ACS 5-year estimates:", years, index=len(years) - 1, format_func=lambda y: "{}-{}".format(y - 4, y))
+    census_df = None
+else:
+    year = 2020
+    with timed("load data", timings):
+        census_df = shared_census_data().get()
+
+# Columns read from the store, memory-mapped once per version of the data and shared by all sessions
+@st.cache_resource(max_entries=64)
+def stored_columns(version, year, level, columns):
+    return load_columns(year, level, list(dict.fromkeys(list(columns) + ["id"]))).sort_values("id")[list(columns)]
+
+# Data function
+def get_data(columns):
+    '''
+    This function returns only the columns a plot needs, ordered by state FIPS code. When the local store has been built the columns are memory-mapped from disk.
+    The returned dataframe is shared by all sessions, so it shouldn't be modified.
+    '''
+    if census_df is None:
+        return stored_columns(version, year, "state", tuple(columns))
+    return census_df[columns]
+
+# Figures are built once per version of the data and shared by all sessions (or loaded if census_store.py built them ahead of time)
+@st.cache_resource
+def figure_cache():
+    return FigureCache(spec_dir=FIGURE_DIR)
+
+# Period covered by the selected estimates, and the variables its release doesn't publish (recorded by census_store.py)
+period = "{}-{}".format(year - 4, year)
+if census_df is None:
+    stored = manifest.get(str(year), {}).get("state", {})
+    version = stored.get("digest", "store-{}".format(year))
+    missing = [VARIABLES[code] for code in stored.get("missing", [])]
+else:
+    version = census_df.attrs["digest"]
+    missing = []
+
+# Geography levels the scatter plots can show: the state data plus any stored county or tract data (counties can also
+# be rolled up from stored tracts)
+if census_df is None:
+    year_levels = stored_levels[year]
+    levels = [level for level in GEOGRAPHY_LEVELS
+              if level == "state" or level in year_levels or (level == "county" and "tract" in year_levels)]
+else:
+    levels = ["state"]
+
+def level_version(level):
+    '''
+    This function returns the version of the data at a geography level, the digest of the stored data it comes from.
+    '''
+    if level == "state":
+        return version
+    source = level if level in stored_levels[year] else "tract"
+    digest = manifest.get(str(year), {}).get(source, {}).get("digest", "store-{}-{}".format(year, source))
+    return digest if source == level else "{}-{}".format(digest, level)
+
+# Counties rolled up from the stored tracts, computed once per version of the data
+@st.cache_resource
+def county_rollup(version):
+    tract_df = load_columns(year, "tract").sort_values("id")
+    tract_df.attrs["digest"] = version
+    return rollup(tract_df, "tract", "county")
+
+def get_level_data(columns, level):
+    '''
+    This function returns only the columns a plot needs at a geography level, ordered by GEOID.
+    '''
+    if level == "state":
+        return get_data(columns)
+    if level in stored_levels[year]:
+        return stored_columns(level_version(level), year, level, tuple(columns))
+    return county_rollup(level_version(level))[columns]
+
+# Regression and correlation statistics of each variable against SNAP participation, computed once per version of the data
+# and geography level
+@st.cache_resource
+def snap_stats(version, level="state"):
+    return relationship_stats(get_level_data(SCATTER_VARS + ["snap_pct", "pop"], level))
 
-# Create dataframe from ACS data based on json response
-census_df = pd.DataFrame(columns=["state","pop","snap","non_snap","below_fpl","less_than_hs","hs","some_college","college_deg","grad_deg","rent","mortgage","black","hispanic","native","unemployed","not_in_labor_force","id"],
-                        data=r.json()[1:])
+# Plot function (chloropleth)
+def plot_chloropleth(var):
+    '''
+    This function takes a variable input and plots a colored chloropleth by state of that variable.
+    '''
+    with timed("chloropleth " + var, timings):
+        st.plotly_chart(figure_cache().get(version, "chloropleth", var, get_data), use_container_width=True)
 
-# Remove observations with missing values (in this case, just Puerto Rico which was missing education statistics)
-census_df = census_df.dropna()
+# Plot function (scatter plot)
+def plot_scatter(var, level="state", density=False):
+    '''
+    This function takes a variable input and plots an interactive scatter graph of that variable against snap participation by state, county, or tract.
+    Counties and tracts are sampled by region (or binned into a density summary) so the browser never gets more than a few thousand points.
+    '''
+    kind = "density" if density else "scatter"
+    with timed("{} {} ({})".format(kind, var, level), timings):
+        st.vega_lite_chart(figure_cache().get(level_version(level), kind, var, lambda columns: get_level_data(columns, level)),
+                           use_container_width=True)
 
-# Convert data types in dataframe except state names to integer data
-cols=[i for i in census_df.columns if i not in ["state"]]
-for col in cols:
-    census_df[col]=census_df[col].astype(int)
-    
-# Convert ACS variables to percentages from whole numbers
-census_df["snap_pct"] = round(census_df["snap"]/census_df["pop"],3) # Percent that receive snap
-census_df["fpl_pct"] = round(census_df["below_fpl"]/census_df["pop"],3) # Percent that are below the federal poverty level
-census_df["deg"] = census_df["some_college"] + census_df["college_deg"] + census_df["grad_deg"] # Number of people w/ greater than high school education
-census_df["deg_pct"] = round(census_df["deg"]/census_df["pop"],3) # Percent with more than a high school education
-census_df["less_than_hs_pct"] = round(census_df["less_than_hs"]/census_df["pop"],3) # Percent with less than high school education
-census_df["hs_pct"] = round(census_df["hs"]/census_df["pop"],3) # Percent with only high school education
-census_df["some_coll_pct"] = round(census_df["some_college"]/census_df["pop"],3) # Percent with only some college or associate's degree
-census_df["college_deg_pct"] = round(census_df["college_deg"]/census_df["pop"],3) # Percent with only bachelor's degree
-census_df["grad_deg_pct"] = round(census_df["grad_deg"]/census_df["pop"],3) # Percent with graduate degree
-census_df["rent_pct"] = round(census_df["rent"]/census_df["pop"],3) # Percent of rented properties
-census_df["mortgage_pct"] = round(census_df["mortgage"]/census_df["pop"],3) # Percent of owned properties with mortgages
-census_df["black_pct"] = round(census_df["black"]/census_df["pop"],3) # Percent of African-Americans
-census_df["hispanic_pct"] = round(census_df["hispanic"]/census_df["pop"],3) # Percent of Hispanics
-census_df["native_pct"] = round(census_df["native"]/census_df["pop"],3) # Percent of Native Americans
-census_df["unemp_pct"] = round(census_df["unemployed"]/census_df["pop"],3) # Percent unemployed
-census_df["not_in_lf_pct"] = round(census_df["not_in_labor_force"]/census_df["pop"],3) # Percent not in labor force
-
-# Add state and region codes and merge to dataframe
-state_dict = {'state':['Pennsylvania', 'California', 'West Virginia', 'Utah', 'New York',
-       'District of Columbia', 'Alaska', 'Florida', 'South Carolina',
-       'North Dakota', 'Maine', 'Georgia', 'Alabama', 'New Hampshire',
-       'Oregon', 'Wyoming', 'Arizona', 'Louisiana', 'Indiana', 'Idaho',
-       'Connecticut', 'Hawaii', 'Illinois', 'Massachusetts', 'Texas',
-       'Montana', 'Nebraska', 'Ohio', 'Colorado', 'New Jersey',
-       'Maryland', 'Virginia', 'Vermont', 'North Carolina', 'Arkansas',
-       'Washington', 'Kansas', 'Oklahoma', 'Wisconsin', 'Mississippi',
-       'Missouri', 'Michigan', 'Rhode Island', 'Minnesota', 'Iowa',
-       'New Mexico', 'Nevada', 'Delaware', 'Kentucky',
-       'South Dakota', 'Tennessee'], 
-              'state_code': ['PA','CA','WV','UT','NY','DC','AK','FL','SC','ND','ME','GA','AL',
-                             'NH','OR','WY','AZ','LA','IN','ID','CT','HI','IL','MA','TX','MT',
-                             'NE','OH','CO','NJ','MD','VA','VT','NC','AR','WA','KS','OK','WI',
-                            'MS','MO','MI','RI','MN','IA','NM','NV','DE','KY','SD','TN'],
-             'region': ['Northeast','West','South','West','Northeast','South','West','South',
-                        'South','Midwest','Northeast','South','South','Northeast','West','West',
-                       'West','South','Midwest','West','Northeast','West','Midwest','Northeast',
-                       'South','West','Midwest','Midwest','West','Northeast','South','South',
-                       'Northeast','South','South','West','Midwest','South','Midwest','South',
-                       'Midwest','Midwest','Northeast','Midwest','Midwest','West','West','South',
-                       'South','Midwest','South']}
-states_df = pd.DataFrame(data=state_dict)
-census_df = census_df.merge(states_df, how='left', on='state')
+# Plot function (stacked bar plot)
+def plot_bar(columns):
+    '''
+    This function takes a tuple of variables and plots a stacked bar plot of them by state.
+    '''
+    with timed("bar " + "/".join(columns), timings):
+        st.plotly_chart(figure_cache().get(version, "bar", columns, get_data), use_container_width=True)
 
 # App title
 st.title("SNAP Participation Dashboard")
 
+if missing:
+    st.info("The ACS {} 5-year release doesn't publish some of our variables ({}), so the plots that use them are empty for these years.".format(period, ", ".join(missing)))
+
 with st.expander("About"): # Add expander
     # App text
     """
@@ -93,23 +177,22 @@ with st.expander("About"): # Add expander
 ## Let's look at our data...
 """
 with st.expander("About the data"): # Add expander
+    f"""
+    Here is a sample of our dataset, featuring our variables of interest taken from the ACS {year} 5-year estimates. Our variables include state, population, SNAP participation rate, poverty rate, unemployment rate, labor force participaton rate, the rate of educational attainment past the high school level, percentages of racial minorities, renting rate, and mortgage rates. All of these variables are state averages over the period of {period}. Our key dependent variable that we'll be analyzing is snap_pct.
     """
-    Here is a sample of our dataset, featuring our variables of interest taken from the ACS 2020 5-year estimates. Our variables include state, population, SNAP participation rate, poverty rate, unemployment rate, labor force participaton rate, the rate of educational attainment past the high school level, percentages of racial minorities, renting rate, and mortgage rates. All of these variables are state averages over the period of 2016-2020. Our key dependent variable that we'll be analyzing is snap_pct.
-    """
-    st.dataframe(census_df[["state","pop","snap_pct","fpl_pct","unemp_pct","not_in_lf_pct","deg_pct","black_pct","hispanic_pct","native_pct","rent_pct","mortgage_pct"]].head())
+    st.dataframe(get_data(["state","pop","snap_pct","fpl_pct","unemp_pct","not_in_lf_pct","deg_pct","black_pct","hispanic_pct","native_pct","rent_pct","mortgage_pct"]).head())
 
-    """
-    The graph below shows the average SNAP participation rate from 2016-2020 by state. If you move your cursor over any of the states in the plot, you'll see both the state code and the percentage of people in that state that rely on SNAP benefits.
+    f"""
+    The graph below shows the average SNAP participation rate from {period} by state. If you move your cursor over any of the states in the plot, you'll see both the state code and the percentage of people in that state that rely on SNAP benefits.
     """
 
-    px_plot = px.choropleth(census_df,
-                        locations='state_code', 
-                        locationmode="USA-states", 
-                        scope="usa",
-                        color='snap_pct',
-                        color_continuous_scale="Viridis_r",                   
-                        )
-    st.plotly_chart(px_plot, use_container_width=True)
+    plot_chloropleth('snap_pct')
+
+    # Our comments on the plots were written for the 2016-2020 estimates
+    if year != 2020:
+        f"""
+    *The comments on this and the following plots describe the 2016-2020 estimates, so some of them may not hold for {period}.*
+    """
 
     """
     As we can see, between 2016-2020, the states with the highest concentrations of SNAP participants tend to be concentrated in the eastern half of the country. There are some exceptions, such as New Mexico and Oregon, that are located in the western half of the country. Let's also note that there are some states that have very high SNAP participation rates in the eastern half, such as West Virginia, Louisiana, Mississippi, Rhode Island, New York, Maine, and Pennsylvania.
@@ -121,33 +204,6 @@ with st.expander("About the data"): # Add expander
 Now, let's look at some of the other variables in our dataset...
 """
 
-# Plot function (chloropleth)
-def plot_chloropleth(var):
-    '''
-    This function takes a variable input and plots a colored chloropleth by state of that variable.
-    '''
-    px_plot_var = px.choropleth(census_df,
-                    locations='state_code', 
-                    locationmode="USA-states", 
-                    scope="usa",
-                    color=var,
-                    color_continuous_scale="Viridis_r",                    
-                    )
-    st.plotly_chart(px_plot_var, use_container_width=True)
-
-# Plot function (scatter plot)
-def plot_scatter(var):
-    '''
-    This function takes a variable input and plots an interactive scatter graph of that variable against snap participation by state.
-    '''
-    alt_plot = alt.Chart(census_df).mark_circle().encode(
-        x=var,
-        y='snap_pct',
-        color='region',
-        size='pop',
-        tooltip=['state','snap_pct'])
-    st.altair_chart(alt_plot + alt_plot.transform_regression(var,'snap_pct').mark_line(), use_container_width=True)
-    
 # Choose your own adventure chloropleths
 with st.expander("Chloropleth variable plots"): # Add expander
     
@@ -213,26 +269,22 @@ with st.expander("Stacked Bar Plots"): # Add expander
 
     if "Race" in b_var:
         # Plot data
-        bar_plot = px.bar(census_df, x="state", y=["black_pct", "hispanic_pct", "native_pct"])
-        st.plotly_chart(bar_plot, use_container_width=True)
+        plot_bar(("black_pct", "hispanic_pct", "native_pct"))
         # Comment on trends
         st.write("This stacked bar plot shows the composition of racial minorities by percentages. It's worth noting here that according to this plot, the states with the largest percentages of racial minorities are New Mexico, Texas, and the District of Columbia. This plot has some relevance because it's likely that people who are members of a racial minority in the United States will have had less opportunity to build generational wealth because of historic barriers, which could potentially influence SNAP eligibility in the long run.")
     elif "Education level: High School or Less" in b_var:
         # Plot data
-        bar_plot = px.bar(census_df, x="state", y=["less_than_hs_pct", "hs_pct"])
-        st.plotly_chart(bar_plot, use_container_width=True)
+        plot_bar(("less_than_hs_pct", "hs_pct"))
         # Comment on trends
         st.write("This stacked bar plot shows the composition of people whose highest level of educational attainment is at the high school level or below. The states with the highest values in this plot are West Virginia, Louisiana, Arkansas, Kentucky, Pennsylvania, and Tennessee. This plot has some relevance as we could use educational attainment level as a proxy for economic mobility. So, the states with proportionately greater numbers of residents with a high school education or less may be more likely to have more residents that are SNAP eligible.")
     elif "Education Level: Greater than High School" in b_var:
         # Plot data
-        bar_plot = px.bar(census_df, x="state", y=["some_coll_pct","college_deg_pct", "grad_deg_pct"])
-        st.plotly_chart(bar_plot, use_container_width=True)
+        plot_bar(("some_coll_pct", "college_deg_pct", "grad_deg_pct"))
         # Comment on trends
         st.write("This stacked bar plot shows the composition of people whose highest level of educational attainment is at higher than a high school level. This includes people with a bachelor's or graduate degree as well as those with some college education but not a degree and an associate's degree. This plot has some relevance as we could use educational attainment level as a proxy for economic mobility. So, in contrast to the previous plot, we can say that the states with the smallest values on this plot tend to have less upwardly economically mobile residents such as West Virginia or Louisiana. In contrast, the states with the largest values on this plot tend to be more upwardly economically mobile, such as the District of Columbia or Washington.")
     else:
         # Plot data
-        bar_plot = px.bar(census_df, x="state", y=["rent_pct","mortgage_pct"])
-        st.plotly_chart(bar_plot, use_container_width=True)
+        plot_bar(("rent_pct", "mortgage_pct"))
         # Comment on trends
         st.write("This stacked bar plot shows the composition of people who rent or have a mortgage by state. The intuition behind this panel is that the states with the highest values on this plot are the states that tend to have the highest comparative cost of living and that are perhaps the least affordable. In a manner of speaking, these are the states where you don't get your bang for your buck, meaning that your salary does not go as far in these states as perhaps it would in more affordable states. So, it's likely that with a higher cost of living that there may also be a greater relative proportion of people who are SNAP eligible. Based on this plot, these states include the District of Columbia, Oregon, California, and Colorado.")
     
@@ -241,58 +293,61 @@ with st.expander("Stacked Bar Plots"): # Add expander
 '''
 ### Two Variable Scatter Plots
 
-Now let's compare our variables side-by-side using a scatter plot. The datapoints are color coded based on census region and sized proportionate to state population.
+Now let's compare our variables side-by-side using a scatter plot. The datapoints are color coded based on census region and sized proportionate to population. When county or tract data has been stored, you can also compare counties or tracts; since there are thousands of them, a sample from each region is plotted (or a density summary of all of them), while the trend line and statistics use every area.
 '''
 
 with st.expander("Scatter plots"): # Add expander
 
+    s_level = st.selectbox("Geography level:", levels) if len(levels) > 1 else "state"
+    s_density = s_level != "state" and st.checkbox("Show a density summary instead of a sample of points")
+
     s_var = st.selectbox("Choose a variable to plot against SNAP participation rate:", ("Poverty Rate", "Unemployment Rate", "Labor Force Participation Rate", "Education Greater than High School", "Percent African-American", "Percent Hispanic", "Percent Native American", "Renting Rate", "Mortgage Rate"))
 
     if "Poverty Rate" in s_var:
         # Plot data
-        plot_scatter('fpl_pct')
+        plot_scatter('fpl_pct', s_level, s_density)
         # Comment on trends
-        st.write("This scatter plot shows the relationship at the state level between the poverty rate and the percentage of people that receive SNAP benefits. As we can see, there is a weak, slightly positive relationship between these two variables. This indicates that there is likely little evidence of feature significance.")
+        st.write("This scatter plot shows the relationship at the " + s_level + " level between the poverty rate and the percentage of people that receive SNAP benefits. " + describe_relationship(snap_stats(level_version(s_level), s_level).loc['fpl_pct']))
     elif "Unemployment Rate" in s_var:
         # Plot data
-        plot_scatter('unemp_pct')
+        plot_scatter('unemp_pct', s_level, s_density)
         # Comment on trends
-        st.write("This scatter plot shows the relationship at the state level between the unemployment rate and the percentage of people that receive SNAP benefits. As we can see, there is a strong positive relationship between these two variables. Thus, it's likely that unemployment has some influence on SNAP participation.")
+        st.write("This scatter plot shows the relationship at the " + s_level + " level between the unemployment rate and the percentage of people that receive SNAP benefits. " + describe_relationship(snap_stats(level_version(s_level), s_level).loc['unemp_pct']))
     elif "Labor Force Participation Rate" in s_var:
         # Plot data
-        plot_scatter('not_in_lf_pct')
+        plot_scatter('not_in_lf_pct', s_level, s_density)
         # Comment on trends
-        st.write("This scatter plot shows the relationship at the state level between the percentage of people not in the labor force and the percentage of people that receive SNAP benefits. As we can see, there is a strong positive relationship between these two variables. Thus, it's likely that not being in the labor force has some influence on SNAP participation.")
+        st.write("This scatter plot shows the relationship at the " + s_level + " level between the percentage of people not in the labor force and the percentage of people that receive SNAP benefits. " + describe_relationship(snap_stats(level_version(s_level), s_level).loc['not_in_lf_pct']))
     elif "Education Greater than High School" in s_var:
         # Plot data
-        plot_scatter('deg_pct')
+        plot_scatter('deg_pct', s_level, s_density)
         # Comment on trends
-        st.write("This scatter plot shows the relationship at the state level between the percentage of people with post-high school education and the percentage of people that receive SNAP benefits. These two variables have a somewhat strong negative relationship. Thus, it's likely that educational attainment has some influence on SNAP participation.")
+        st.write("This scatter plot shows the relationship at the " + s_level + " level between the percentage of people with post-high school education and the percentage of people that receive SNAP benefits. " + describe_relationship(snap_stats(level_version(s_level), s_level).loc['deg_pct']))
     elif "Percent African-American" in s_var:
         # Plot data
-        plot_scatter('black_pct')
+        plot_scatter('black_pct', s_level, s_density)
         # Comment on trends
-        st.write("This scatter plot shows the relationship at the state level between the percentage of African-Americans and the percentage of people that receive SNAP benefits. As we can see, there is a weak, slightly positive relationship between these two variables. This indicates that there is likely little evidence of feature significance.")
+        st.write("This scatter plot shows the relationship at the " + s_level + " level between the percentage of African-Americans and the percentage of people that receive SNAP benefits. " + describe_relationship(snap_stats(level_version(s_level), s_level).loc['black_pct']))
     elif "Percent Hispanic" in s_var:
         # Plot data
-        plot_scatter('hispanic_pct')
+        plot_scatter('hispanic_pct', s_level, s_density)
         # Comment on trends
-        st.write("This scatter plot shows the relationship at the state level between the percentage of Hispanic people and the percentage of people that receive SNAP benefits. As we can see, there is likely a correlation coefficient close to zero for these two variables. This indicates that this variable is not of any significance.")
+        st.write("This scatter plot shows the relationship at the " + s_level + " level between the percentage of Hispanic people and the percentage of people that receive SNAP benefits. " + describe_relationship(snap_stats(level_version(s_level), s_level).loc['hispanic_pct']))
     elif "Percent Native American" in s_var:
         # Plot data
-        plot_scatter('native_pct')
+        plot_scatter('native_pct', s_level, s_density)
         # Comment on trends
-        st.write("This scatter plot shows the relationship at the state level between the percentage of Native Americans and the percentage of people that receive SNAP benefits. As we can see, there is likely a correlation coefficient close to zero for these two variables. This indicates that this variable is not of any significance.")
+        st.write("This scatter plot shows the relationship at the " + s_level + " level between the percentage of Native Americans and the percentage of people that receive SNAP benefits. " + describe_relationship(snap_stats(level_version(s_level), s_level).loc['native_pct']))
     elif "Renting Rate" in s_var:
         # Plot data
-        plot_scatter('rent_pct')
+        plot_scatter('rent_pct', s_level, s_density)
         # Comment on trends
-        st.write("This scatter plot shows the relationship at the state level between the renting rate and the percentage of people that receive SNAP benefits. As we can see, there is a weak, slightly negative relationship between these two variables. This indicates that there is likely little evidence of feature significance.")
+        st.write("This scatter plot shows the relationship at the " + s_level + " level between the renting rate and the percentage of people that receive SNAP benefits. " + describe_relationship(snap_stats(level_version(s_level), s_level).loc['rent_pct']))
     else:
         # Plot data
-        plot_scatter('mortgage_pct')
+        plot_scatter('mortgage_pct', s_level, s_density)
         # Comment on trends
-        st.write("This scatter plot shows the relationship at the state level between the mortgage rate and the percentage of people that receive SNAP benefits. These two variables have a somewhat strong negative relationship. Thus, it's likely that mortgage rates have some influence on SNAP participation.")
+        st.write("This scatter plot shows the relationship at the " + s_level + " level between the mortgage rate and the percentage of people that receive SNAP benefits. " + describe_relationship(snap_stats(level_version(s_level), s_level).loc['mortgage_pct']))
 
     
 # Text box for user input    
@@ -322,4 +377,10 @@ U.S. Census Bureau (2022). *2016-2020 American Community Survey 5-year Estimates
 U.S. Department of Agriculture. (2018, September 11). *A short history of snap.* USDA Food and Nutrition Service. Retrieved from https://www.fns.usda.gov/snap/short-history-snap 
 
 VanderPlas, J., Granger, B., Heer, J., Moritz, D., Wongsuphasawat, K., Satyanarayan, A., … Sievert, S. (2018). Altair: Interactive statistical visualizations for python. *Journal of Open Source Software*, 3(32), 1057.
-'''
\ No newline at end of file
+'''
+
+# Per-rerun timings (only when CENSUS_PROFILE=1)
+if timings is not None:
+    timings.append(("rerun", round((time.perf_counter() - rerun_start) * 1000, 2)))
+    st.sidebar.subheader("Rerun timings (ms)")
+    st.sidebar.dataframe(pd.DataFrame(timings, columns=["step", "ms"]), hide_index=True)
@@ -0,0 +1,235 @@
+# Benchmarks for the app's load-wrangle-render path, plus timing hooks for the running app
+#
+# Run the benchmarks from a terminal with, for example:
+#     python census_bench.py --levels state county tract
+# They replay a fixture of Census API responses in offline mode, so no network access is needed. The first run
+# writes a synthetic fixture at national scale to bench_fixture/. To benchmark against real responses instead,
+# record them once with:
+#     python census_bench.py --record --year 2020 --levels state county tract
+# Save the results with --json and pass them back with --baseline on a later run to see how each stage changed.
+import argparse
+import gc
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+
+from census_data import VARIABLES, add_percentages, add_states, clean_counts, decode_chunks, state_dict
+from census_fetch import GEOGRAPHY_LEVELS, CensusCache, fetch_geography, geography_requests, plan_chunks
+from census_figures import BAR_GROUPS, FIGURE_KINDS
+from census_lod import rollup
+
+# Location of the recorded or synthetic API responses the benchmarks replay
+FIXTURE_DIR = os.environ.get("CENSUS_BENCH_FIXTURE", "bench_fixture")
+
+# Number of timed runs of each stage (the median is reported)
+REPEAT = 5
+
+# Number of areas in each state in the synthetic fixture (about 3,200 counties and 85,000 tracts in total), and
+# the typical population of an area at each level
+SYNTHETIC_AREAS = {"county": 63, "tract": 1670}
+SYNTHETIC_POP = {"state": 6000000, "county": 100000, "tract": 4000}
+
+# Show per-rerun timings in the app's sidebar (set the environment variable CENSUS_PROFILE=1)
+PROFILE = os.environ.get("CENSUS_PROFILE", "").lower() in ("1", "true", "yes")
+
+
+@contextmanager
+def timed(name, timings):
+    '''
+    This function times the code in a with block and appends (name, milliseconds) to timings. It does nothing
+    when timings is None, so the app can leave its hooks in place when profiling is off.
+    '''
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.append((name, round((time.perf_counter() - start) * 1000, 2)))
+
+
+def fixture_cache(fixture_dir=FIXTURE_DIR):
+    '''
+    This function returns a response cache for a fixture directory. Entries never expire or get evicted.
+    '''
+    return CensusCache(fixture_dir, ttl=float("inf"), max_bytes=float("inf"))
+
+
+def record_fixture(levels, year, fixture_dir=FIXTURE_DIR):
+    '''
+    This function requests the app's variables from the Census API at each geography level and saves the
+    responses to fixture_dir, so the benchmarks can replay them offline.
+    '''
+    for level in levels:
+        fetch_geography(level, year, list(VARIABLES), cache=fixture_cache(fixture_dir), offline=False,
+                        stream=True)
+
+
+def _synthetic_body(variables, geography, rng):
+    # One response in the API's format (a JSON array of string rows, one per line) with random but plausible counts
+    states = dict(zip(state_dict["fips"], state_dict["state"]))
+    states[72] = "Puerto Rico"
+    if "in" in geography:
+        fips = [int(geography["in"].split(":")[1])]
+    else:
+        fips = sorted(states)
+    level = geography["for"].split(":")[0]
+    areas = SYNTHETIC_AREAS.get(level, 1)
+
+    rows = []
+    for f in fips:
+        for i in range(areas):
+            if level == "state":
+                geo, name = ["%02d" % f], states[f]
+            elif level == "county":
+                geo, name = ["%02d" % f, "%03d" % (2 * i + 1)], "County %d, %s" % (2 * i + 1, states[f])
+            else:
+                county = i // 25 * 2 + 1
+                geo = ["%02d" % f, "%03d" % county, "%06d" % (100 * i + 100)]
+                name = "Census Tract %d, County %d, %s" % (i + 1, county, states[f])
+            # Some tracts (parks, airports, water) have nobody living in them
+            pop = 0 if level == "tract" and i % 400 == 0 else int(rng.lognormal(0, 0.5) * SYNTHETIC_POP[level])
+            values = [str(int(pop * share)) for share in rng.uniform(0, 0.5, len(variables) - 2)]
+            if f == 72:
+                # Puerto Rico is missing the education statistics, as in the real data
+                values = [None if code.startswith("B06009") else v for code, v in zip(variables[2:], values)]
+            elif level == "tract" and i % 97 == 0:
+                values[-1] = "-666666666" # Too few sample observations
+            rows.append([name, str(pop)] + values + geo)
+
+    header = list(variables) + ["state", "county", "tract"][:len(rows[0]) - len(variables)]
+    return ("[" + ",\n".join(json.dumps(row) for row in [header] + rows) + "]").encode()
+
+
+def synthetic_fixture(levels, year, fixture_dir=FIXTURE_DIR, seed=0):
+    '''
+    This function writes a fixture of random responses for the app's variables at each geography level to
+    fixture_dir, shaped like the real API's (about 52 states, 3,200 counties, or 85,000 tracts).
+    '''
+    rng = np.random.default_rng(seed)
+    cache = fixture_cache(fixture_dir)
+    for level in levels:
+        for variables in plan_chunks(list(VARIABLES)):
+            for geography in geography_requests(level):
+                cache.store(cache.key("acs/acs5", year, variables, geography),
+                            _synthetic_body(variables, geography, rng),
+                            {"url": "synthetic", "fetched_at": time.time()})
+
+
+def build_figures(census_df, level):
+    '''
+    This function builds and serializes one figure of each kind the app shows, as the app does on a cache miss.
+    The maps and bar plots are built from the data rolled up to states.
+    '''
+    state_df = rollup(census_df, level, "state")
+    for kind, param, df in (("chloropleth", "snap_pct", state_df), ("bar", BAR_GROUPS[0], state_df),
+                            ("scatter", "fpl_pct", census_df), ("density", "fpl_pct", census_df)):
+        build, columns, to_json, _ = FIGURE_KINDS[kind]
+        to_json(build(df[columns(param)], param))
+
+
+def measure(fn, *args, repeat=REPEAT):
+    '''
+    This function runs fn(*args) repeat times and returns its result with the median wall time in milliseconds.
+    It then runs it once more under tracemalloc for the peak memory allocated during the call and the memory
+    blocks (and bytes) still allocated after it. Temporary allocations freed during the call only show up in the
+    peak, not in the retained blocks.
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        times.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    baseline = tracemalloc.get_traced_memory()[0]
+    result = fn(*args)
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    diff = tracemalloc.take_snapshot().compare_to(before, "filename")
+    tracemalloc.stop()
+    return result, {"ms": round(float(np.median(times)) * 1000, 2), "peak_mb": round(peak / 2**20, 2),
+                    "retained_blocks": sum(stat.count_diff for stat in diff),
+                    "retained_mb": round(sum(stat.size_diff for stat in diff) / 2**20, 2)}
+
+
+def run_level(level, year, fixture_dir=FIXTURE_DIR, repeat=REPEAT):
+    '''
+    This function runs every stage of the pipeline for a geography level against the fixture, feeding each
+    stage the output of the one before it, and returns one row of measurements per stage.
+    '''
+    cache = fixture_cache(fixture_dir)
+    stages = [
+        ("fetch", lambda _: fetch_geography(level, year, list(VARIABLES), cache=cache, offline=True,
+                                            stream=True)),
+        ("decode", decode_chunks),
+        ("cast", clean_counts),
+        ("ratios", add_percentages),
+        ("merge", add_states),
+        ("figures", lambda census_df: build_figures(census_df, level)),
+    ]
+    rows = []
+    data = None
+    for stage, fn in stages:
+        output, stats = measure(fn, data, repeat=repeat)
+        data = output if output is not None else data
+        rows.append(dict(level=level, stage=stage, rows=len(data) if hasattr(data, "columns") else None, **stats))
+    return rows
+
+
+def print_results(rows, baseline=None):
+    '''
+    This function prints the measurements as a table, with the change in wall time from a baseline run if given.
+    '''
+    before = {(row["level"], row["stage"]): row for row in baseline or []}
+    print("{:<7} {:<8} {:>7} {:>10} {:>9} {:>16} {:>12}{}".format(
+        "level", "stage", "rows", "ms", "peak MB", "retained blocks", "retained MB", "  vs baseline" if baseline else ""))
+    for row in rows:
+        change = ""
+        if (row["level"], row["stage"]) in before and before[(row["level"], row["stage"])]["ms"]:
+            change = "  {:+.0%}".format(row["ms"] / before[(row["level"], row["stage"])]["ms"] - 1)
+        print("{:<7} {:<8} {:>7} {:>10.2f} {:>9.2f} {:>16} {:>12.2f}{}".format(
+            row["level"], row["stage"], row["rows"] if row["rows"] is not None else "", row["ms"], row["peak_mb"],
+            row["retained_blocks"], row["retained_mb"], change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the app's data pipeline offline against a fixture.")
+    parser.add_argument("--levels", nargs="+", default=["state", "county"], choices=GEOGRAPHY_LEVELS)
+    parser.add_argument("--year", type=int, default=2020)
+    parser.add_argument("--fixture", default=FIXTURE_DIR)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--record", action="store_true", help="record the fixture from the Census API first")
+    parser.add_argument("--json", help="save the results to this file")
+    parser.add_argument("--baseline", help="compare with results saved by an earlier run")
+    args = parser.parse_args()
+
+    if args.record:
+        record_fixture(args.levels, args.year, args.fixture)
+    cache = fixture_cache(args.fixture)
+    missing = [level for level in args.levels
+               if cache.load(cache.key("acs/acs5", args.year, plan_chunks(list(VARIABLES))[0],
+                                       geography_requests(level)[-1]))[0] is None]
+    if missing:
+        print("Writing a synthetic fixture for {} to {}".format(", ".join(missing), args.fixture))
+        synthetic_fixture(missing, args.year, args.fixture)
+
+    rows = [row for level in args.levels for row in run_level(level, args.year, args.fixture, args.repeat)]
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_results(rows, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
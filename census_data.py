@@ -0,0 +1,301 @@
+# Helpers for turning raw ACS responses into the dataframe used by the app
+import hashlib
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import ExitStack
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from census_decode import decode_response
+from census_fetch import SingleFlight
+
+# ACS variable codes and the column names we use for them
+VARIABLES = {
+    "NAME": "name",
+    "B01001_001E": "pop",
+    "B19058_002E": "snap",
+    "B19058_003E": "non_snap",
+    "B17020I_002E": "below_fpl",
+    "B06009_002E": "less_than_hs",
+    "B06009_003E": "hs",
+    "B06009_004E": "some_college",
+    "B06009_005E": "college_deg",
+    "B06009_006E": "grad_deg",
+    "B08137_003E": "rent",
+    "B25081_002E": "mortgage",
+    "B02001_003E": "black",
+    "B03001_003E": "hispanic",
+    "B02001_004E": "native",
+    "B27011_008E": "unemployed",
+    "B27011_013E": "not_in_labor_force",
+}
+
+# ACS variable codes that changed between vintages, by year: {year: {code in VARIABLES: code used that year}}.
+# Variables that aren't published at all for a vintage are detected from the API and left missing.
+VARIABLE_RENAMES = {}
+
+# Geography columns the API appends to each row, in the order they make up the GEOID, and their widths in digits
+GEO_COLUMNS = {"state": 2, "county": 3, "tract": 6}
+
+# Percentage columns and the count column each one is computed from (all are divided by pop)
+PCT_COLUMNS = {
+    "snap_pct": "snap", # Percent that receive snap
+    "fpl_pct": "below_fpl", # Percent that are below the federal poverty level
+    "deg_pct": "deg", # Percent with more than a high school education
+    "less_than_hs_pct": "less_than_hs", # Percent with less than high school education
+    "hs_pct": "hs", # Percent with only high school education
+    "some_coll_pct": "some_college", # Percent with only some college or associate's degree
+    "college_deg_pct": "college_deg", # Percent with only bachelor's degree
+    "grad_deg_pct": "grad_deg", # Percent with graduate degree
+    "rent_pct": "rent", # Percent of rented properties
+    "mortgage_pct": "mortgage", # Percent of owned properties with mortgages
+    "black_pct": "black", # Percent of African-Americans
+    "hispanic_pct": "hispanic", # Percent of Hispanics
+    "native_pct": "native", # Percent of Native Americans
+    "unemp_pct": "unemployed", # Percent unemployed
+    "not_in_lf_pct": "not_in_labor_force", # Percent not in labor force
+}
+
+# State names, state codes, census regions, and FIPS codes
+state_dict = {'state':['Pennsylvania', 'California', 'West Virginia', 'Utah', 'New York',
+       'District of Columbia', 'Alaska', 'Florida', 'South Carolina',
+       'North Dakota', 'Maine', 'Georgia', 'Alabama', 'New Hampshire',
+       'Oregon', 'Wyoming', 'Arizona', 'Louisiana', 'Indiana', 'Idaho',
+       'Connecticut', 'Hawaii', 'Illinois', 'Massachusetts', 'Texas',
+       'Montana', 'Nebraska', 'Ohio', 'Colorado', 'New Jersey',
+       'Maryland', 'Virginia', 'Vermont', 'North Carolina', 'Arkansas',
+       'Washington', 'Kansas', 'Oklahoma', 'Wisconsin', 'Mississippi',
+       'Missouri', 'Michigan', 'Rhode Island', 'Minnesota', 'Iowa',
+       'New Mexico', 'Nevada', 'Delaware', 'Kentucky',
+       'South Dakota', 'Tennessee'],
+              'state_code': ['PA','CA','WV','UT','NY','DC','AK','FL','SC','ND','ME','GA','AL',
+                             'NH','OR','WY','AZ','LA','IN','ID','CT','HI','IL','MA','TX','MT',
+                             'NE','OH','CO','NJ','MD','VA','VT','NC','AR','WA','KS','OK','WI',
+                            'MS','MO','MI','RI','MN','IA','NM','NV','DE','KY','SD','TN'],
+             'region': ['Northeast','West','South','West','Northeast','South','West','South',
+                        'South','Midwest','Northeast','South','South','Northeast','West','West',
+                       'West','South','Midwest','West','Northeast','West','Midwest','Northeast',
+                       'South','West','Midwest','Midwest','West','Northeast','South','South',
+                       'Northeast','South','South','West','Midwest','South','Midwest','South',
+                       'Midwest','Midwest','Northeast','Midwest','Midwest','West','West','South',
+                       'South','Midwest','South'],
+             'fips': [42,6,54,49,36,11,2,12,45,38,23,13,1,33,41,56,4,22,18,16,9,15,17,25,48,30,
+                      31,39,8,34,24,51,50,37,5,53,20,40,55,28,29,26,44,27,19,35,32,10,21,46,47]}
+states_df = pd.DataFrame(data=state_dict)
+
+# Built dataframes, keyed by a hash of the raw payload. Shared by every session in the process.
+_frame_cache = OrderedDict()
+_frame_cache_lock = threading.Lock()
+FRAME_CACHE_SIZE = 8
+
+# Dataframes currently being built, so sessions that ask for the same data at the same time share one build
+_building = SingleFlight()
+
+
+def _flatten(payloads):
+    # Accept a single body, a list of bodies, or a list of chunks that are each a list of bodies. A body can also be
+    # the path of a cached response (see census_fetch.fetch_geography with stream=True) or a file opened from one.
+    if isinstance(payloads, (bytes, str, io.IOBase)):
+        return [payloads]
+    return [body for item in payloads for body in _flatten(item)]
+
+
+def _open_payloads(payloads, stack):
+    # Replace the paths of cached responses with files opened on stack, keeping the nesting of payloads
+    if isinstance(payloads, str):
+        return stack.enter_context(open(payloads, "rb"))
+    if isinstance(payloads, (bytes, io.IOBase)):
+        return payloads
+    return [_open_payloads(item, stack) for item in payloads]
+
+
+def _hash_file(f):
+    # Hash an open response a block at a time from its current position, then rewind it for decoding
+    start = f.tell()
+    file_hash = hashlib.sha256()
+    for block in iter(lambda: f.read(1024 * 1024), b""):
+        file_hash.update(block)
+    f.seek(start)
+    return file_hash.digest()
+
+
+def payload_digest(payloads):
+    '''
+    This function returns a hash of one or more raw API responses, used to tell different versions of the data apart.
+    '''
+    digest = hashlib.sha256()
+    for payload in _flatten(payloads):
+        if isinstance(payload, str):
+            # Hash a cached response a block at a time, giving the same digest as its contents would
+            with open(payload, "rb") as f:
+                digest.update(_hash_file(f))
+        elif isinstance(payload, io.IOBase):
+            digest.update(_hash_file(payload))
+        else:
+            digest.update(hashlib.sha256(payload).digest())
+    return digest.hexdigest()
+
+
+def _concat_columns(arrays):
+    # Stack the same column from several decoded responses, keeping categoricals categorical
+    if len(arrays) == 1:
+        return arrays[0]
+    if isinstance(arrays[0], pd.Categorical):
+        return union_categoricals(arrays)
+    return pd.concat([pd.Series(a) for a in arrays], ignore_index=True).array
+
+
+def _decode_payload(payload):
+    # Decode one response, streaming it from disk when it is the path of a cached response or an open file
+    categorical = ["NAME"] + list(GEO_COLUMNS)
+    if isinstance(payload, str):
+        with open(payload, "rb") as f:
+            return decode_response(f, categorical=categorical, size_hint=os.path.getsize(payload))
+    if isinstance(payload, io.IOBase):
+        return decode_response(payload, categorical=categorical, size_hint=os.fstat(payload.fileno()).st_size)
+    return decode_response(payload, categorical=categorical)
+
+
+def decode_chunk(payloads):
+    '''
+    This function decodes the ACS responses for one chunk of variables (one response per geography request, as
+    bytes or as paths of cached responses, which are read incrementally) into a typed dataframe indexed by the
+    numeric GEOID. Estimates become integer columns (nullable where the ACS reports missing or annotated values)
+    and NAME/geography columns become categoricals.
+    '''
+    parts = [_decode_payload(payload) for payload in _flatten(payloads)]
+    columns = {name: _concat_columns([part[name] for part in parts]) for name in parts[0]}
+
+    # Build the GEOID from the geography columns (e.g. state + county + tract) and use it as the join key
+    geoid = 0
+    for col, width in GEO_COLUMNS.items():
+        if col in columns:
+            codes = columns[col]
+            geoid = geoid * 10**width + np.asarray(codes.categories.astype("int64"))[codes.codes]
+    return pd.DataFrame(columns, index=pd.Index(geoid, name="geoid"), copy=False)
+
+
+def join_chunks(frames):
+    '''
+    This function joins decoded chunks into a single dataframe on GEOID. Columns are reused rather than copied,
+    except when a chunk came back with its rows in a different order and has to be realigned.
+    '''
+    base = frames[0]
+    columns = {col: base[col].array for col in base.columns}
+    for frame in frames[1:]:
+        if not frame.index.equals(base.index):
+            frame = frame.reindex(base.index)
+        for col in frame.columns:
+            if col not in columns:
+                columns[col] = frame[col].array
+    return pd.DataFrame(columns, index=base.index, copy=False)
+
+
+def decode_chunks(chunks):
+    '''
+    This function decodes and joins the raw ACS responses returned by census_fetch.fetch_geography (one list of
+    responses per chunk of variables) into a single dataframe indexed by GEOID.
+    '''
+    return join_chunks([decode_chunk(payloads) for payloads in chunks])
+
+
+def wrangle(raw_df):
+    '''
+    This function takes the joined ACS data at state, county, or tract level (see decode_chunk and join_chunks) and
+    returns the cleaned dataframe with percentage columns and state codes/regions. It doesn't modify its input.
+    Any extra variables that were requested (e.g. margins of error) are kept under their ACS codes, and variables
+    that weren't requested because a vintage doesn't publish them are left missing.
+    '''
+    return add_states(add_percentages(clean_counts(raw_df)))
+
+
+def clean_counts(raw_df):
+    '''
+    This function renames the joined ACS data to the names in VARIABLES, drops areas with missing values, adds the
+    id (GEOID) and state fips columns, and stores the counts as plain integers. It doesn't modify its input.
+    '''
+    census_df = raw_df.rename(columns=VARIABLES)
+
+    # Remove observations with missing values (in this case, just Puerto Rico which was missing education statistics)
+    cols = [VARIABLES[c] for c in VARIABLES if c in raw_df.columns]
+    census_df = census_df.dropna(subset=cols)
+    census_df = census_df.assign(**{VARIABLES[c]: pd.array([pd.NA] * len(census_df), dtype="Int32")
+                                    for c in VARIABLES if c not in raw_df.columns})
+
+    # Use the numeric GEOID as the id and drop the geography columns
+    geo_cols = [c for c in GEO_COLUMNS if c in raw_df.columns]
+    census_df = census_df.drop(columns=geo_cols)
+    census_df["id"] = census_df.index
+    census_df = census_df.reset_index(drop=True)
+
+    # The state FIPS code is the first two digits of the GEOID
+    census_df["fips"] = census_df["id"] // 10**(sum(GEO_COLUMNS[c] for c in geo_cols) - GEO_COLUMNS["state"])
+
+    # Now that missing values are gone, store the ACS count columns as plain integers in one pass
+    return census_df.astype({col: getattr(census_df[col].dtype, "numpy_dtype", census_df[col].dtype)
+                             for col in cols if col != "name"})
+
+
+def add_percentages(census_df):
+    '''
+    This function returns a copy of a dataframe of ACS counts with the deg column and the percentage columns added.
+    '''
+    # Number of people w/ greater than high school education
+    census_df = census_df.assign(deg=census_df["some_college"] + census_df["college_deg"] + census_df["grad_deg"])
+
+    # Convert ACS variables to percentages from whole numbers with a single division over the count block
+    # (areas with no population, which happen at tract level, get missing percentages)
+    counts = census_df[list(PCT_COLUMNS.values())].to_numpy(dtype="float64", na_value=np.nan)
+    pop = census_df["pop"].to_numpy(dtype="float64")[:, None]
+    pcts = np.round(np.divide(counts, pop, out=np.full_like(counts, np.nan), where=pop > 0), 3)
+    return pd.concat([census_df, pd.DataFrame(pcts, columns=list(PCT_COLUMNS), index=census_df.index)], axis=1)
+
+
+def add_states(census_df):
+    '''
+    This function adds state names, state codes, and regions by state fips code, keeping only the 50 states and DC.
+    '''
+    return census_df.merge(states_df, how='inner', on='fips')
+
+
+def build_census_df(chunks, renames=None):
+    '''
+    This function returns the cleaned dataframe for the raw ACS responses returned by census_fetch.fetch_geography
+    (one list of responses per chunk of variables). renames maps codes used by an older vintage back to the codes
+    in VARIABLES (see VARIABLE_RENAMES). Results are memoized per process by a hash of the payloads, so every
+    session shares one copy. Callers should treat the returned dataframe as read-only.
+    '''
+    renames = renames or {}
+    with ExitStack() as stack:
+        # Open each cached response once, so the digest and the dataframe come from the same contents even if the
+        # cache replaces or evicts the file in between
+        chunks = _open_payloads(chunks, stack)
+        digest = payload_digest(chunks)
+        if renames:
+            digest = payload_digest([digest.encode(), json.dumps(renames, sort_keys=True).encode()])
+        with _frame_cache_lock:
+            if digest in _frame_cache:
+                _frame_cache.move_to_end(digest)
+                return _frame_cache[digest]
+        return _building.do(digest, lambda: _build_census_df(chunks, renames, digest))
+
+
+def _build_census_df(chunks, renames, digest):
+    # Decode and clean the payloads, then remember the result (unless another build stored it first)
+    with _frame_cache_lock:
+        if digest in _frame_cache:
+            return _frame_cache[digest]
+    raw_df = decode_chunks(chunks)
+    census_df = wrangle(raw_df.rename(columns=renames) if renames else raw_df)
+    census_df.attrs["digest"] = digest
+
+    with _frame_cache_lock:
+        _frame_cache[digest] = census_df
+        while len(_frame_cache) > FRAME_CACHE_SIZE:
+            _frame_cache.popitem(last=False)
+    return census_df
@@ -0,0 +1,140 @@
+# Streaming decoder for Census API JSON responses into typed NumPy/pandas columns
+import io
+import itertools
+import json
+
+import numpy as np
+import pandas as pd
+
+# Annotation values the ACS uses in place of an estimate or margin of error (e.g. -666666666 means the estimate
+# couldn't be computed because there were too few sample observations). All of them are decoded as missing.
+SENTINELS = frozenset([-999999999, -888888888, -666666666, -555555555, -333333333, -222222222])
+
+# Number of rows parsed and converted to columns at a time
+BATCH_ROWS = 4096
+
+
+class _NumberColumn:
+    # Preallocated integer column (with a missing value mask) that switches to floats if a decimal value shows up
+
+    def __init__(self, capacity):
+        self.values = np.zeros(capacity, dtype="int64")
+        self.mask = np.zeros(capacity, dtype=bool)
+        self.is_float = False
+
+    def grow(self, capacity):
+        # Copy into zeroed arrays (np.resize would fill the new space with repeats of the old values and mask)
+        values = np.zeros(capacity, dtype=self.values.dtype)
+        mask = np.zeros(capacity, dtype=bool)
+        values[:len(self.values)] = self.values
+        mask[:len(self.mask)] = self.mask
+        self.values, self.mask = values, mask
+
+    def set(self, start, values):
+        end = start + len(values)
+        missing = None
+        if None in values:
+            missing = np.array([value is None for value in values])
+            values = ["0" if value is None else value for value in values]
+        try:
+            numbers = np.fromiter(map(int, values), dtype=self.values.dtype, count=len(values))
+        except ValueError:
+            if not self.is_float:
+                self.values = self.values.astype("float64")
+                self.is_float = True
+            numbers = np.fromiter(map(float, values), dtype="float64", count=len(values))
+        self.values[start:end] = numbers
+        sentinels = np.isin(numbers, list(SENTINELS))
+        self.mask[start:end] = sentinels if missing is None else sentinels | missing
+
+    def finish(self, n):
+        values, mask = self.values[:n], self.mask[:n]
+        if self.is_float:
+            values[mask] = np.nan
+            return values
+        # Use 32 bit integers whenever the values fit
+        if n and -2**31 < values.min() and values.max() < 2**31:
+            values = values.astype("int32")
+        if mask.any():
+            return pd.arrays.IntegerArray(values, mask)
+        return values
+
+
+class _CategoryColumn:
+    # Column of repeated strings stored as integer codes into a list of unique values
+
+    def __init__(self, capacity):
+        self.codes = np.zeros(capacity, dtype="int32")
+        self.lookup = {}
+
+    def grow(self, capacity):
+        codes = np.zeros(capacity, dtype=self.codes.dtype)
+        codes[:len(self.codes)] = self.codes
+        self.codes = codes
+
+    def set(self, start, values):
+        lookup = self.lookup
+        codes = [-1 if value is None else lookup.setdefault(value, len(lookup)) for value in values]
+        self.codes[start:start + len(codes)] = codes
+
+    def finish(self, n):
+        return pd.Categorical.from_codes(self.codes[:n], categories=list(self.lookup))
+
+
+def _read_batches(stream):
+    # Yield the rows of a JSON array of arrays in batches, reading the body a line at a time. The Census API puts
+    # each row on its own line, so a batch of lines can be parsed with a single json.loads call.
+    lines = []
+    first = True
+    for line in stream:
+        line = line.strip().rstrip(b",")
+        if first:
+            if not line.startswith(b"["):
+                raise ValueError("Census response is not a JSON array")
+            line = line[1:]
+            first = False
+        if line.endswith(b"]]") or line == b"]":
+            line = line[:-1] # End of the outer array
+        if line:
+            lines.append(line)
+        if len(lines) == BATCH_ROWS:
+            yield json.loads(b"[" + b",".join(lines) + b"]")
+            lines = []
+    if lines:
+        yield json.loads(b"[" + b",".join(lines) + b"]")
+
+
+def decode_response(body, categorical=(), size_hint=None):
+    '''
+    This function decodes a Census API response (bytes or a binary file object such as a streamed response body)
+    without building the whole JSON document in memory. Values are written straight into preallocated columns:
+    numbers become int32/int64 arrays (nullable when there are missing values or ACS sentinels, float64 for
+    decimal variables) and the columns named in categorical become pandas Categoricals.
+    It returns a dictionary of column name to array, in the order of the response header.
+    '''
+    if isinstance(body, (bytes, bytearray, memoryview)):
+        size_hint = size_hint or len(body)
+        body = io.BytesIO(body)
+    batches = _read_batches(body)
+    batch = next(batches, None)
+    if batch is None:
+        raise ValueError("Census response is empty")
+    header, batch = batch[0], batch[1:]
+
+    # Guess the number of rows from the body size and grow as needed
+    capacity = max(64, (size_hint or 0) // (12 * len(header) + 4))
+    columns = [(_CategoryColumn if name in categorical else _NumberColumn)(capacity) for name in header]
+
+    # Convert rows a batch at a time so each column is parsed with a single NumPy call per batch
+    n = 0
+    for batch in itertools.chain([batch], batches):
+        if not batch:
+            continue
+        if n + len(batch) > capacity:
+            capacity = max(capacity * 2, n + len(batch))
+            for column in columns:
+                column.grow(capacity)
+        for column, values in zip(columns, zip(*batch)):
+            column.set(n, values)
+        n += len(batch)
+    return {name: column.finish(n) for name, column in zip(header, columns)}
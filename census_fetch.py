@@ -0,0 +1,377 @@
+# Helpers for requesting ACS data from the Census API with an on-disk cache
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Base URL for the Census data API
+CENSUS_API_URL = "https://api.census.gov/data"
+
+# Cache settings (can be overridden with environment variables)
+CACHE_DIR = os.environ.get("CENSUS_CACHE_DIR", ".census_cache")
+CACHE_TTL = int(os.environ.get("CENSUS_CACHE_TTL", 24 * 60 * 60)) # Seconds before a cached response is revalidated
+CACHE_MAX_BYTES = int(os.environ.get("CENSUS_CACHE_MAX_BYTES", 500 * 1024 * 1024)) # Total size allowed on disk
+OFFLINE = os.environ.get("CENSUS_OFFLINE", "").lower() in ("1", "true", "yes")
+
+# Optional API key, recommended for tract level pulls which take one request per state
+API_KEY = os.environ.get("CENSUS_API_KEY")
+
+# The API rejects requests for more than 50 variables (NAME included)
+MAX_VARIABLES = 50
+
+# Fetch engine settings
+MAX_WORKERS = int(os.environ.get("CENSUS_MAX_WORKERS", 8)) # Concurrent requests to the API
+REQUESTS_PER_SECOND = float(os.environ.get("CENSUS_REQUESTS_PER_SECOND", 10))
+STREAM_CHUNK_BYTES = 1024 * 1024 # Bytes read from the network at a time when a response is streamed to the cache
+
+# FIPS codes for the 50 states and the District of Columbia
+STATE_FIPS = ["01","02","04","05","06","08","09","10","11","12","13","15","16","17","18","19","20",
+              "21","22","23","24","25","26","27","28","29","30","31","32","33","34","35","36","37",
+              "38","39","40","41","42","44","45","46","47","48","49","50","51","53","54","55","56"]
+
+# Geography levels we can fetch
+GEOGRAPHY_LEVELS = ("state", "county", "tract")
+
+
+class CensusCache:
+    '''
+    This class stores raw Census API responses on disk. Each response is saved as a body file plus a small
+    metadata file with the time it was fetched and the ETag/Last-Modified headers used for revalidation.
+    '''
+
+    def __init__(self, cache_dir=CACHE_DIR, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+    def key(self, dataset, year, variables, geography):
+        '''
+        This function builds a cache key from the dataset, year, variable list, and geography of a request.
+        '''
+        spec = json.dumps({"dataset": dataset, "year": str(year), "variables": list(variables), "geography": geography},
+                          sort_keys=True)
+        return hashlib.sha256(spec.encode("utf-8")).hexdigest()
+
+    def _paths(self, key):
+        return (os.path.join(self.cache_dir, key + ".json"),
+                os.path.join(self.cache_dir, key + ".meta.json"))
+
+    def load(self, key, stream=False):
+        '''
+        This function returns the cached body and metadata for a key, or (None, None) if nothing is cached. With
+        stream=True the path of the body file is returned instead of its contents, so it can be read incrementally.
+        '''
+        body_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if stream:
+                os.stat(body_path)
+                body = body_path
+            else:
+                with open(body_path, "rb") as f:
+                    body = f.read()
+        except (OSError, ValueError):
+            return None, None
+        # Bump the modification time so eviction drops the least recently used entries first (skipped when the
+        # cache directory is read-only, e.g. a deployed app or a shared fixture)
+        try:
+            os.utime(body_path)
+        except OSError:
+            pass
+        return body, meta
+
+    def is_fresh(self, meta):
+        return time.time() - meta.get("fetched_at", 0) < self.ttl
+
+    def store(self, key, body, meta):
+        '''
+        This function writes a response body (bytes, or an iterable of bytes such as a streamed response) and its
+        metadata to disk, then evicts old entries if the cache is too big. It returns the path of the body file.
+        '''
+        os.makedirs(self.cache_dir, exist_ok=True)
+        body_path, meta_path = self._paths(key)
+        # Write to temporary files first so a crash never leaves a half-written entry behind
+        for path, data, mode in ((body_path, body, "wb"), (meta_path, json.dumps(meta), "w")):
+            with open(path + ".tmp", mode) as f:
+                if isinstance(data, (bytes, str)):
+                    f.write(data)
+                else:
+                    for part in data:
+                        f.write(part)
+            os.replace(path + ".tmp", path)
+        self.evict()
+        return body_path
+
+    def touch(self, key, meta):
+        '''
+        This function marks a cached entry as fresh again after the server confirmed it has not changed.
+        '''
+        meta["fetched_at"] = time.time()
+        with open(self._paths(key)[1], "w") as f:
+            json.dump(meta, f)
+
+    def evict(self):
+        '''
+        This function removes the least recently used entries until the cache fits within max_bytes.
+        '''
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".json") and not name.endswith(".meta.json"):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except OSError: # Removed by another thread in the meantime
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name[:-len(".json")]))
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+
+
+class RateLimiter:
+    '''
+    This class spaces out requests so that all threads together stay under a number of requests per second.
+    '''
+
+    def __init__(self, per_second=REQUESTS_PER_SECOND):
+        self.interval = 1.0 / per_second if per_second > 0 else 0
+        self.next_time = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class SingleFlight:
+    '''
+    This class coalesces concurrent calls for the same key: the first caller runs the function and everyone who
+    asks for that key while it is running waits for and shares its result (or its exception).
+    '''
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+        if leader:
+            try:
+                future.set_result(fn())
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self.lock:
+                    del self.calls[key]
+        return future.result()
+
+
+# Requests currently being made, so sessions starting at the same time share one API call per response
+_in_flight = SingleFlight()
+
+
+def make_session(pool_size=MAX_WORKERS):
+    '''
+    This function creates a requests session with a connection pool big enough for the thread pool and retries
+    with exponential backoff on rate limiting and server errors.
+    '''
+    retry = Retry(total=5, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET"])
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    return session
+
+
+def cached_get(url, params, key, cache, offline=None, session=None, limiter=None, stream=False):
+    '''
+    This function returns the body of a GET request through the on-disk cache: fresh entries are served without a
+    request, stale entries are revalidated with ETag/Last-Modified, and the last good copy is served in offline
+    mode or when the API can't be reached. Concurrent calls for the same cache entry share a single request.
+    With stream=True the response is written to the cache as it downloads and the path of the cached body is
+    returned instead of the body, so it never has to be held in memory at once.
+    '''
+    return _in_flight.do((cache.cache_dir, key, stream),
+                         lambda: _cached_get(url, params, key, cache, offline, session, limiter, stream))
+
+
+def _cached_get(url, params, key, cache, offline, session, limiter, stream):
+    offline = OFFLINE if offline is None else offline
+    body, meta = cache.load(key, stream)
+
+    if body is not None and (offline or cache.is_fresh(meta)):
+        return body
+    if offline:
+        raise RuntimeError("No cached Census data for {} {} while in offline mode".format(url, params))
+
+    # Revalidate the cached copy if we have one
+    headers = {}
+    if meta is not None:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    params = dict(params)
+    if API_KEY:
+        params["key"] = API_KEY
+    if limiter is not None:
+        limiter.wait()
+    try:
+        r = (session or requests).get(url, params=params, headers=headers, timeout=30, stream=stream)
+        if r.status_code == 304 and body is not None:
+            try:
+                cache.touch(key, meta)
+            except OSError: # Read-only cache directory, the cached copy is still good
+                pass
+            return body
+        r.raise_for_status()
+        meta = {
+            "url": url,
+            "fetched_at": time.time(),
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+        }
+        if stream:
+            return _store_stream(cache, key, r, meta, body)
+    except requests.RequestException:
+        # Serve the last good snapshot when the API is slow or down
+        if body is not None:
+            return body
+        raise
+
+    try:
+        cache.store(key, r.content, meta)
+    except OSError: # Read-only cache directory, serve the response without caching it
+        pass
+    return r.content
+
+
+def _store_stream(cache, key, r, meta, body):
+    # Write a streamed response to the cache and return its path. If the cache directory can't be written before
+    # any of the response was read (e.g. it is read-only), read the response into memory instead. If writing fails
+    # partway through, the rest of the response can't be recovered, so fall back to the cached copy if there is one.
+    started = False
+
+    def parts():
+        nonlocal started
+        for part in r.iter_content(STREAM_CHUNK_BYTES):
+            started = True
+            yield part
+
+    try:
+        return cache.store(key, parts(), meta)
+    except OSError:
+        if not started:
+            return r.content
+        if body is not None:
+            return body
+        raise
+
+
+def fetch_acs(year, variables, geography, dataset="acs/acs5", cache=None, offline=None, session=None, limiter=None,
+              stream=False):
+    '''
+    This function requests ACS variables for a geography (e.g. {"for": "state:*"}) and returns the raw JSON body
+    (or, with stream=True, the path of the cached body), using the on-disk cache. At most MAX_VARIABLES variables
+    can be requested at once.
+    '''
+    cache = cache or CensusCache()
+    params = dict(geography)
+    params["get"] = ",".join(variables)
+    return cached_get("{}/{}/{}".format(CENSUS_API_URL, year, dataset), params,
+                      cache.key(dataset, year, variables, geography), cache, offline, session, limiter, stream)
+
+
+def group_variables(year, group, dataset="acs/acs5", moe=True, cache=None, offline=None, session=None, limiter=None):
+    '''
+    This function lists the estimate variables (and optionally the margin of error variables) in an ACS table,
+    e.g. group_variables(2020, "B06009") returns ["B06009_001E", "B06009_001M", ...].
+    '''
+    cache = cache or CensusCache()
+    body = cached_get("{}/{}/{}/groups/{}.json".format(CENSUS_API_URL, year, dataset, group), {},
+                      cache.key(dataset, year, [], {"group": group}), cache, offline, session, limiter)
+    suffixes = ("E", "M") if moe else ("E",)
+    return sorted(name for name in json.loads(body)["variables"]
+                  if name.startswith(group + "_") and name.endswith(suffixes))
+
+
+def plan_chunks(variables, limit=MAX_VARIABLES):
+    '''
+    This function splits a variable list into chunks the API will accept (at most limit variables each).
+    Duplicates are dropped and NAME, if requested, is only fetched with the first chunk.
+    '''
+    variables = list(dict.fromkeys(variables))
+    name = ["NAME"] if "NAME" in variables else []
+    rest = [v for v in variables if v != "NAME"]
+    chunks = [name + rest[:limit - len(name)]]
+    rest = rest[limit - len(name):]
+    chunks += [rest[i:i + limit] for i in range(0, len(rest), limit)]
+    return chunks
+
+
+def geography_requests(level):
+    '''
+    This function lists the geography parameters needed to fetch every area at a level. Tracts have to be
+    requested one state at a time, while states and counties come back from a single request.
+    '''
+    if level == "state":
+        return [{"for": "state:*"}]
+    if level == "county":
+        return [{"for": "county:*"}]
+    if level == "tract":
+        return [{"for": "tract:*", "in": "state:" + fips} for fips in STATE_FIPS]
+    raise ValueError("Unknown geography level {!r}, expected one of {}".format(level, GEOGRAPHY_LEVELS))
+
+
+def fetch_geography(level, year, variables, dataset="acs/acs5", cache=None, offline=None, max_workers=MAX_WORKERS,
+                    session=None, limiter=None, stream=False):
+    '''
+    This function fetches any number of ACS variables for every area at a geography level ("state", "county", or
+    "tract"). The variables are split into chunks the API accepts and every chunk/geography request runs
+    concurrently on a bounded thread pool sharing one pooled session and rate limiter. Pass session and limiter to
+    share them with other calls running at the same time, so they stay under the limits together. It returns the
+    raw JSON bodies (or with stream=True the paths of the cached bodies, which census_data decodes incrementally)
+    as a list with one entry per chunk, each a list with one body per geography request.
+    '''
+    chunks = plan_chunks(variables)
+    geographies = geography_requests(level)
+    cache = cache or CensusCache()
+    jobs = [(chunk, geography) for chunk in chunks for geography in geographies]
+    if len(jobs) == 1:
+        return [[fetch_acs(year, chunks[0], geographies[0], dataset, cache=cache, offline=offline, session=session,
+                           limiter=limiter, stream=stream)]]
+
+    limiter = limiter or RateLimiter()
+    own_session = session is None
+    session = session or make_session(max_workers)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            bodies = list(pool.map(lambda job: fetch_acs(year, job[0], job[1], dataset, cache=cache, offline=offline,
+                                                         session=session, limiter=limiter, stream=stream),
+                                   jobs))
+    finally:
+        if own_session:
+            session.close()
+    n = len(geographies)
+    return [bodies[i:i + n] for i in range(0, len(bodies), n)]
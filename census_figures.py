@@ -0,0 +1,173 @@
+# Figure builders for the app's plots, plus a cache so each figure is only built once per version of the data
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import altair as alt
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+import plotly.io as pio
+
+from census_lod import density_bins, sample_by_region
+from census_stats import relationship_stats, trend_line
+
+# Maximum number of figures kept in memory (can be overridden with an environment variable)
+FIGURE_CACHE_SIZE = int(os.environ.get("CENSUS_FIGURE_CACHE_SIZE", 128))
+
+# Variables offered in the chloropleth and scatter plot menus, and the groups of columns in the stacked bar plots
+CHLOROPLETH_VARS = ["snap_pct", "fpl_pct", "unemp_pct", "not_in_lf_pct", "deg_pct", "black_pct", "hispanic_pct",
+                    "native_pct", "rent_pct", "mortgage_pct"]
+SCATTER_VARS = ["fpl_pct", "unemp_pct", "not_in_lf_pct", "deg_pct", "black_pct", "hispanic_pct", "native_pct",
+                "rent_pct", "mortgage_pct"]
+BAR_GROUPS = [("black_pct", "hispanic_pct", "native_pct"), ("less_than_hs_pct", "hs_pct"),
+              ("some_coll_pct", "college_deg_pct", "grad_deg_pct"), ("rent_pct", "mortgage_pct")]
+
+
+def chloropleth_figure(df, var):
+    '''
+    This function plots a colored chloropleth by state of a variable. df needs the state_code column and var.
+    '''
+    return px.choropleth(df,
+                    locations='state_code',
+                    locationmode="USA-states",
+                    scope="usa",
+                    color=var,
+                    color_continuous_scale="Viridis_r",
+                    )
+
+
+def _trend_chart(df, var):
+    # OLS trend line fitted on all of df, so it stays exact when only a sample or summary of the points is drawn
+    xs, ys = trend_line(relationship_stats(df, columns=[var]).loc[var], df[var].min(), df[var].max())
+    return alt.Chart(pd.DataFrame({var: xs, 'snap_pct': ys})).mark_line().encode(x=var, y='snap_pct')
+
+
+def scatter_chart(df, var):
+    '''
+    This function returns the Vega-Lite spec of an interactive scatter graph of a variable against snap
+    participation by area, with the OLS trend line computed here rather than in the browser. Above MAX_POINTS areas
+    (counties or tracts) a sample stratified by region is drawn. df needs var and the snap_pct, region, pop, and
+    name columns.
+    '''
+    alt_plot = alt.Chart(sample_by_region(df)).mark_circle().encode(
+        x=var,
+        y='snap_pct',
+        color='region',
+        size='pop',
+        tooltip=['name','snap_pct'])
+    return (alt_plot + _trend_chart(df, var)).to_dict()
+
+
+def density_chart(df, var):
+    '''
+    This function returns the Vega-Lite spec of a density summary of var against snap participation for data with
+    many areas: points are binned into a grid, and each bin is sized by its number of areas and colored by its
+    population. df needs var and the snap_pct and pop columns.
+    '''
+    alt_plot = alt.Chart(density_bins(df, var)).mark_circle().encode(
+        x=var,
+        y='snap_pct',
+        size='areas',
+        color='pop',
+        tooltip=['areas','pop'])
+    return (alt_plot + _trend_chart(df, var)).to_dict()
+
+
+def bar_figure(df, columns):
+    '''
+    This function plots a stacked bar plot of columns by state. df needs the state column and columns.
+    '''
+    return px.bar(df, x="state", y=list(columns))
+
+
+class PlotlySpec(go.Figure):
+    '''
+    This class holds the serialized spec of a plotly figure (the dict from Figure.to_dict) and gives it back as is
+    when st.plotly_chart serializes it. Passing st.plotly_chart the dict itself makes plotly validate it again, and
+    passing the figure makes plotly copy it, on every rerun. Only the spec is kept, so its properties (layout,
+    data) are empty and changing them has no effect.
+    '''
+
+    def __init__(self, spec):
+        super().__init__()
+        self._spec = spec
+
+    def to_dict(self):
+        return self._spec
+
+
+def _plotly_spec(build):
+    # Build a plotly figure and keep only its serialized spec
+    return lambda df, param: PlotlySpec(build(df, param).to_dict())
+
+
+# How to build, save, and load each kind of figure: (builder, columns it needs, to JSON, from JSON)
+FIGURE_KINDS = {
+    "chloropleth": (_plotly_spec(chloropleth_figure), lambda var: ["state_code", var], pio.to_json,
+                    lambda spec: PlotlySpec(json.loads(spec))),
+    "scatter": (scatter_chart, lambda var: [var, "snap_pct", "region", "pop", "name"], json.dumps, json.loads),
+    "density": (density_chart, lambda var: [var, "snap_pct", "pop"], json.dumps, json.loads),
+    "bar": (_plotly_spec(bar_figure), lambda columns: ["state"] + list(columns), pio.to_json,
+            lambda spec: PlotlySpec(json.loads(spec))),
+}
+
+
+def _file_name(kind, param):
+    return "{}-{}.json".format(kind, "-".join(param) if isinstance(param, tuple) else param)
+
+
+class FigureCache:
+    '''
+    This class keeps built figures in memory, keyed by the version of the data (its digest), the kind of figure,
+    and the selected variable(s). The least recently used figures are dropped once there are more than max_size.
+    If spec_dir is given, figures saved ahead of time by precompute_figures are loaded from there before building.
+    Figures are kept serialized (Vega-Lite dicts, or plotly specs in a PlotlySpec), so a rerun only sends them.
+    '''
+
+    def __init__(self, max_size=FIGURE_CACHE_SIZE, spec_dir=None):
+        self.max_size = max_size
+        self.spec_dir = spec_dir
+        self.figures = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, version, kind, param, get_data):
+        '''
+        This function returns the figure for a version of the data, building it from get_data(columns) on a miss.
+        Figures are shared by every session, so callers shouldn't modify them.
+        '''
+        key = (version, kind, param)
+        with self.lock:
+            if key in self.figures:
+                self.figures.move_to_end(key)
+                return self.figures[key]
+
+        build, columns, _, from_json = FIGURE_KINDS[kind]
+        path = os.path.join(self.spec_dir, version, _file_name(kind, param)) if self.spec_dir else None
+        if path and os.path.exists(path):
+            with open(path) as f:
+                figure = from_json(f.read())
+        else:
+            figure = build(get_data(columns(param)), param)
+
+        with self.lock:
+            self.figures[key] = figure
+            while len(self.figures) > self.max_size:
+                self.figures.popitem(last=False)
+        return figure
+
+
+def precompute_figures(census_df, version, spec_dir):
+    '''
+    This function builds every figure offered in the app for a version of the data and saves them as JSON in
+    spec_dir/version/, so the app can load them instead of building them.
+    '''
+    os.makedirs(os.path.join(spec_dir, version), exist_ok=True)
+    params = ([("chloropleth", var) for var in CHLOROPLETH_VARS] + [("scatter", var) for var in SCATTER_VARS]
+              + [("bar", columns) for columns in BAR_GROUPS])
+    for kind, param in params:
+        build, columns, to_json, _ = FIGURE_KINDS[kind]
+        figure = build(census_df[columns(param)], param)
+        with open(os.path.join(spec_dir, version, _file_name(kind, param)), "w") as f:
+            f.write(to_json(figure))
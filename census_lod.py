@@ -0,0 +1,96 @@
+# Level of detail helpers, so plots of county and tract data send a bounded number of rows to the browser
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from census_data import GEO_COLUMNS, VARIABLES, add_percentages, add_states
+
+# Most rows sent to a scatter plot (Altair refuses to embed more than 5,000 rows by default)
+MAX_POINTS = 5000
+
+# Number of bins along each axis of a density summary
+DENSITY_BINS = 40
+
+# Digits of the GEOID at each geography level
+GEOID_DIGITS = {"state": 2, "county": 5, "tract": 11}
+
+# Rollups already computed, keyed by the digest of the source data and the level rolled up to
+_rollup_cache = OrderedDict()
+_rollup_cache_lock = threading.Lock()
+ROLLUP_CACHE_SIZE = 8
+
+
+def rollup(census_df, from_level, to_level):
+    '''
+    This function aggregates a cleaned dataframe (from census_data.build_census_df) from tracts or counties up to
+    counties or states by summing the ACS counts and recomputing the percentages. Results are memoized per process
+    by the digest of the source data, so each rollup is only computed once per version of the data.
+    '''
+    if from_level == to_level:
+        return census_df
+    key = (census_df.attrs.get("digest"), to_level)
+    with _rollup_cache_lock:
+        if key[0] is not None and key in _rollup_cache:
+            _rollup_cache.move_to_end(key)
+            return _rollup_cache[key]
+
+    # The GEOID of the coarser level is a prefix of the finer one
+    group_id = census_df["id"] // 10**(GEOID_DIGITS[from_level] - GEOID_DIGITS[to_level])
+    counts = [name for code, name in VARIABLES.items() if code != "NAME"]
+    rolled_df = census_df[counts].groupby(group_id.rename("id")).sum(min_count=1).reset_index()
+    rolled_df["fips"] = rolled_df["id"] // 10**(GEOID_DIGITS[to_level] - GEO_COLUMNS["state"])
+    rolled_df = add_states(add_percentages(rolled_df))
+
+    # Names of the coarser areas: a tract's NAME ends with its county and state ("Census Tract 101, Adams County,
+    # Pennsylvania", separated by semicolons since 2023)
+    if to_level == "state":
+        rolled_df["name"] = rolled_df["state"]
+    else:
+        names = census_df["name"].groupby(group_id).first().astype(str)
+        rolled_df["name"] = names.str.split(r"[,;] ", n=1, regex=True).str[1].reindex(rolled_df["id"]).to_numpy()
+    rolled_df.attrs["digest"] = key[0]
+
+    if key[0] is not None:
+        with _rollup_cache_lock:
+            _rollup_cache[key] = rolled_df
+            while len(_rollup_cache) > ROLLUP_CACHE_SIZE:
+                _rollup_cache.popitem(last=False)
+    return rolled_df
+
+
+def sample_by_region(df, max_points=MAX_POINTS, seed=0):
+    '''
+    This function returns at most max_points rows of df, sampled within each census region in proportion to its
+    number of rows so every region keeps its share of the plot. The sample is the same on every call.
+    '''
+    if len(df) <= max_points:
+        return df
+    # Round each region's share down, then hand the leftover points to the regions with the largest remainders,
+    # so the sample never has more than max_points rows
+    groups = df.groupby("region", observed=True)
+    shares = groups.size() * max_points / len(df)
+    counts = np.floor(shares).astype("int64")
+    leftover = max_points - counts.sum()
+    counts[(shares - counts).sort_values(ascending=False).index[:leftover]] += 1
+    return pd.concat([group.sample(n=counts[region], random_state=seed) for region, group in groups])
+
+
+def density_bins(df, var, y="snap_pct", bins=DENSITY_BINS):
+    '''
+    This function summarizes a scatter of var against y as a grid of bins, returning one row per non-empty bin
+    with the bin's center, its number of areas, and the total population living in them.
+    '''
+    data = df[[var, y, "pop"]].dropna()
+    x_edges = np.linspace(data[var].min(), data[var].max(), bins + 1)
+    y_edges = np.linspace(data[y].min(), data[y].max(), bins + 1)
+    areas, _, _ = np.histogram2d(data[var], data[y], bins=[x_edges, y_edges])
+    pop, _, _ = np.histogram2d(data[var], data[y], bins=[x_edges, y_edges], weights=data["pop"])
+    i, j = np.nonzero(areas)
+    return pd.DataFrame({
+        var: (x_edges[i] + x_edges[i + 1]) / 2,
+        y: (y_edges[j] + y_edges[j + 1]) / 2,
+        "areas": areas[i, j].astype("int64"),
+        "pop": pop[i, j],
+    })
@@ -0,0 +1,95 @@
+# Shared data for serving many app sessions from one process
+import logging
+import os
+import threading
+import weakref
+
+from census_fetch import CACHE_TTL, SingleFlight
+
+# Seconds between background refreshes of the shared data (0 turns them off). By default the data is refreshed
+# as often as the cached API responses expire.
+REFRESH_INTERVAL = int(os.environ.get("CENSUS_REFRESH_SECONDS", CACHE_TTL))
+
+logger = logging.getLogger(__name__)
+
+
+class SharedDataset:
+    '''
+    This class holds one copy of a dataset (e.g. the cleaned dataframe from census_data.build_census_df) shared by
+    every session in the process. Nothing enforces it, so callers must treat the copy as read-only. The first call
+    to get() runs load(), and sessions starting at the same time wait for that one load instead of starting their
+    own. After that, a background thread calls load() again every refresh_interval seconds and swaps in the new
+    copy atomically. A session that already has the old copy keeps it until its next rerun, and a failed refresh
+    keeps the old copy. Use shared_dataset to get the process-wide instance for a dataset.
+    '''
+
+    def __init__(self, load, refresh_interval=REFRESH_INTERVAL):
+        self.load = load
+        self.refresh_interval = refresh_interval
+        self.current = None
+        self.flight = SingleFlight()
+        self.stopped = threading.Event()
+        self.refresher = None
+
+    def get(self):
+        '''
+        This function returns the current copy of the data, loading it on the first call. Callers shouldn't modify it.
+        '''
+        current = self.current
+        if current is None:
+            current = self.flight.do("load", self._first_load)
+        return current
+
+    def _first_load(self):
+        if self.current is None:
+            self.current = self.load()
+            if self.refresh_interval > 0:
+                # The thread only holds a weak reference, so it ends once the dataset is no longer used
+                self.refresher = threading.Thread(target=_refresh_loop, name="census-refresh", daemon=True,
+                                                  args=(weakref.ref(self), self.stopped, self.refresh_interval))
+                self.refresher.start()
+        return self.current
+
+    def refresh(self):
+        '''
+        This function reloads the data now and swaps it in, returning the new copy.
+        '''
+        data = self.flight.do("load", self.load)
+        self.current = data
+        return data
+
+    def stop(self):
+        '''
+        This function stops the background refreshes.
+        '''
+        self.stopped.set()
+
+
+def _refresh_loop(dataset_ref, stopped, interval):
+    # Refresh a SharedDataset every interval seconds until it is stopped or garbage collected
+    while not stopped.wait(interval):
+        dataset = dataset_ref()
+        if dataset is None:
+            return
+        try:
+            dataset.refresh()
+        except Exception:
+            logger.exception("Refreshing the shared data failed, keeping the current copy")
+        del dataset
+
+
+# Datasets shared by the whole process, by name (see shared_dataset)
+_datasets = {}
+_datasets_lock = threading.Lock()
+
+
+def shared_dataset(name, load, refresh_interval=REFRESH_INTERVAL):
+    '''
+    This function returns the SharedDataset registered under name, creating it with load on first use. The
+    instances live at module level rather than in a cache that can be cleared (e.g. st.cache_resource), so there
+    is only ever one copy of the data and one background refresher per name, however often the app reruns.
+    '''
+    with _datasets_lock:
+        if name not in _datasets:
+            _datasets[name] = SharedDataset(load, refresh_interval)
+        return _datasets[name]
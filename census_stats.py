@@ -0,0 +1,82 @@
+# Regression and correlation statistics for the app's variables against SNAP participation
+import numpy as np
+import pandas as pd
+
+
+def _weighted_fit(x, y, w):
+    # Weighted least squares fits and correlations of every column of y on the matching column of x at once.
+    # x, y, and w are (rows, variables) arrays with zero weight wherever either value is missing.
+    x = np.nan_to_num(x)
+    y = np.nan_to_num(y)
+    total = w.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_x = (w * x).sum(axis=0) / total
+        mean_y = (w * y).sum(axis=0) / total
+        dx = x - mean_x
+        dy = y - mean_y
+        sxx = (w * dx * dx).sum(axis=0)
+        syy = (w * dy * dy).sum(axis=0)
+        sxy = (w * dx * dy).sum(axis=0)
+        slope = sxy / sxx
+        r = sxy / np.sqrt(sxx * syy)
+    return slope, mean_y - slope * mean_x, r
+
+
+def relationship_stats(df, y="snap_pct", weight="pop", columns=None):
+    '''
+    This function computes, for every *_pct column (or the given columns) against y, the OLS slope and intercept,
+    Pearson's r, Spearman's rho, and the same statistics weighted by population, in one batched NumPy pass.
+    Rows where either value is missing are left out of each pair. It returns a dataframe indexed by variable.
+    '''
+    if columns is None:
+        columns = [c for c in df.columns if c.endswith("_pct") and c != y]
+    x = df[columns].to_numpy(dtype="float64", copy=True)
+    y_values = np.repeat(df[y].to_numpy(dtype="float64")[:, None], len(columns), axis=1)
+    valid = ~np.isnan(x) & ~np.isnan(y_values)
+    x[~valid] = np.nan
+    y_values[~valid] = np.nan
+
+    # Ranks for Spearman's rho, computed per pair so missing values don't shift them
+    x_ranks = pd.DataFrame(x).rank().to_numpy()
+    y_ranks = pd.DataFrame(y_values).rank().to_numpy()
+
+    ones = valid.astype("float64")
+    pop = np.nan_to_num(df[weight].to_numpy(dtype="float64"))[:, None] * ones
+    slope, intercept, r = _weighted_fit(x, y_values, ones)
+    w_slope, w_intercept, w_r = _weighted_fit(x, y_values, pop)
+    rho = _weighted_fit(x_ranks, y_ranks, ones)[2]
+    w_rho = _weighted_fit(x_ranks, y_ranks, pop)[2]
+
+    return pd.DataFrame({"n": valid.sum(axis=0), "slope": slope, "intercept": intercept, "r": r, "r2": r ** 2,
+                         "spearman": rho, "weighted_slope": w_slope, "weighted_intercept": w_intercept,
+                         "weighted_r": w_r, "weighted_spearman": w_rho}, index=pd.Index(columns, name="variable"))
+
+
+def trend_line(fit, x_min, x_max):
+    '''
+    This function returns the two end points of a fitted OLS line over the range of x as (xs, ys).
+    '''
+    xs = np.array([x_min, x_max], dtype="float64")
+    return xs, fit["intercept"] + fit["slope"] * xs
+
+
+def describe_relationship(fit):
+    '''
+    This function writes a short interpretation of a row of relationship_stats, based on the size and sign of
+    Pearson's r, and reports the population-weighted and rank correlations alongside it.
+    '''
+    r = fit["r"]
+    if np.isnan(r):
+        return "There isn't enough data to measure the relationship between these two variables."
+    numbers = "(r = {:.2f}, Spearman's rho = {:.2f}, r weighted by population = {:.2f})".format(
+        r, fit["spearman"], fit["weighted_r"])
+    if abs(r) < 0.1:
+        return ("As we can see, the correlation coefficient is close to zero for these two variables {}. "
+                "This indicates that this variable is not of any significance.".format(numbers))
+    direction = "positive" if r > 0 else "negative"
+    if abs(r) < 0.3:
+        return ("As we can see, there is a weak, slightly {} relationship between these two variables {}. "
+                "This indicates that there is likely little evidence of feature significance.".format(direction, numbers))
+    strength = "moderate" if abs(r) < 0.5 else "strong"
+    return ("As we can see, there is a {} {} relationship between these two variables {}. "
+            "Thus, it's likely that this variable has some influence on SNAP participation.".format(strength, direction, numbers))
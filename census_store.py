@@ -0,0 +1,250 @@
+# Local columnar store for the cleaned ACS data, so the app doesn't have to call the API on start
+#
+# Build or refresh the store from a terminal with, for example:
+#     python census_store.py --levels state county
+# Only the years and geography levels that are missing or stale are fetched, so adding a new ACS release costs a
+# single pull:
+#     python census_store.py --years 2024
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs
+import requests
+
+from census_data import VARIABLE_RENAMES, VARIABLES, build_census_df
+from census_fetch import GEOGRAPHY_LEVELS, MAX_WORKERS, RateLimiter, fetch_geography, group_variables, make_session
+from census_figures import precompute_figures
+
+# Location of the store (can be overridden with an environment variable)
+STORE_DIR = os.environ.get("CENSUS_STORE_DIR", "census_store")
+
+# Figures built ahead of time for each version of the data (see census_figures.precompute_figures)
+FIGURE_DIR = os.path.join(STORE_DIR, "figures")
+
+# Seconds before the newest vintage's stored data is considered stale and checked against the API again. Older
+# vintages are final, so they are only fetched when missing (or with --force).
+STORE_TTL = int(os.environ.get("CENSUS_STORE_TTL", 30 * 24 * 60 * 60))
+
+# ACS 5-year vintages available from the API (2010 covers 2006-2010)
+ACS5_YEARS = list(range(2010, 2025))
+
+# Number of vintages fetched at the same time (each one also fetches its geographies concurrently)
+YEAR_WORKERS = 4
+
+# Columns the data is partitioned on, in directory order (e.g. year=2020/level=state/state_code=PA/)
+PARTITION_COLUMNS = ["year", "level", "state_code"]
+
+_manifest_lock = threading.Lock()
+
+
+def _to_table(census_df):
+    # Convert the dataframe to an Arrow table. Categoricals get 32 bit indices so every partition file has the same
+    # schema.
+    table = pa.Table.from_pandas(census_df, preserve_index=False).replace_schema_metadata(None)
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(pa.dictionary(pa.int32(), pa.string())))
+    return table
+
+
+def _partition_dir(year, level, root):
+    return os.path.join(root, "year={}".format(year), "level={}".format(level))
+
+
+def write_partition(census_df, year, level, root=STORE_DIR):
+    '''
+    This function writes a cleaned dataframe (from census_data.build_census_df) to the store as uncompressed
+    Arrow files partitioned by year, geography level, and state, replacing any data already stored for them.
+    '''
+    ds.write_dataset(_to_table(census_df), _partition_dir(year, level, root), format="ipc",
+                     partitioning=PARTITION_COLUMNS[2:], partitioning_flavor="hive",
+                     existing_data_behavior="delete_matching")
+
+
+def has_data(year, level, root=STORE_DIR):
+    '''
+    This function checks whether the store has data for a year and geography level.
+    '''
+    return os.path.isdir(_partition_dir(year, level, root))
+
+
+def available_years(level, root=STORE_DIR):
+    '''
+    This function lists the years the store has data for at a geography level, oldest first.
+    '''
+    if not os.path.isdir(root):
+        return []
+    return sorted(int(name[len("year="):]) for name in os.listdir(root)
+                  if name.startswith("year=") and has_data(name[len("year="):], level, root))
+
+
+def available_levels(year, root=STORE_DIR):
+    '''
+    This function lists the geography levels the store has data for in a year, from coarsest to finest.
+    '''
+    return [level for level in GEOGRAPHY_LEVELS if has_data(year, level, root)]
+
+
+def load_columns(year, level, columns=None, states=None, root=STORE_DIR):
+    '''
+    This function reads columns (all of them if columns is None) for a year and geography level from the store,
+    optionally only for some states (by state code), and returns them as a dataframe. The files are memory-mapped,
+    so only the columns that are read get paged in from disk.
+    '''
+    dataset = ds.dataset(_partition_dir(year, level, root), format="ipc",
+                         partitioning=ds.partitioning(pa.schema([("state_code", pa.string())]), flavor="hive"),
+                         filesystem=pyarrow.fs.LocalFileSystem(use_mmap=True))
+    condition = ds.field("state_code").isin(list(states)) if states is not None else None
+    return dataset.to_table(columns=columns, filter=condition).to_pandas(split_blocks=True)
+
+
+def _manifest_path(root):
+    return os.path.join(root, "manifest.json")
+
+
+def read_manifest(root=STORE_DIR):
+    '''
+    This function returns the store manifest, which records when each year and geography level was last fetched:
+    {"2020": {"state": {"fetched_at": ..., "digest": ..., "rows": ..., "missing": [...]}}}
+    '''
+    try:
+        with open(_manifest_path(root)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def store_version(root=STORE_DIR):
+    '''
+    This function returns a value that changes whenever ingest updates the store (the modification time of the
+    manifest), so callers can cache what they read from the store until it changes.
+    '''
+    try:
+        return os.stat(_manifest_path(root)).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _update_manifest(year, level, entry, root):
+    with _manifest_lock:
+        manifest = read_manifest(root)
+        manifest.setdefault(str(year), {})[level] = entry
+        os.makedirs(root, exist_ok=True)
+        with open(_manifest_path(root) + ".tmp", "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(_manifest_path(root) + ".tmp", _manifest_path(root))
+
+
+def stale_partitions(years, levels, root=STORE_DIR, ttl=STORE_TTL):
+    '''
+    This function lists the (year, level) pairs that are missing from the store, plus those of the newest vintage
+    that are older than ttl seconds. Published vintages don't change, so older ones never go stale.
+    '''
+    manifest = read_manifest(root)
+    newest = max(ACS5_YEARS + list(years))
+    stale = []
+    for year in years:
+        for level in levels:
+            entry = manifest.get(str(year), {}).get(level)
+            if entry is None or not has_data(year, level, root):
+                stale.append((year, level))
+            elif year == newest and time.time() - entry["fetched_at"] >= ttl:
+                stale.append((year, level))
+    return stale
+
+
+def vintage_variables(year, session=None, limiter=None):
+    '''
+    This function reconciles VARIABLES with what a vintage publishes. It returns a dictionary mapping each code in
+    VARIABLES to the code to request for that year (see census_data.VARIABLE_RENAMES), leaving out variables whose
+    table doesn't exist in that vintage (e.g. the health insurance tables before 2012). Any error other than the
+    API's 404 for a missing table is raised, so a failed lookup never gets recorded as a missing variable.
+    '''
+    renames = VARIABLE_RENAMES.get(year, {})
+    codes = {code: renames.get(code, code) for code in VARIABLES}
+    available = {"NAME"}
+    for group in sorted({code.rsplit("_", 1)[0] for code in codes.values() if code != "NAME"}):
+        try:
+            available.update(group_variables(year, group, moe=False, session=session, limiter=limiter))
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 404:
+                raise
+            # Table not published for this vintage
+    return {code: vintage_code for code, vintage_code in codes.items() if vintage_code in available}
+
+
+def _build(year, level, codes, session, limiter):
+    # Fetch and clean one year and geography level, requesting that vintage's codes (see vintage_variables) and
+    # renaming them back
+    census_df = build_census_df(fetch_geography(level, year, list(codes.values()),
+                                                max_workers=max(1, MAX_WORKERS // YEAR_WORKERS),
+                                                session=session, limiter=limiter, stream=True),
+                                renames={v: k for k, v in codes.items() if k != v})
+    return census_df, [code for code in VARIABLES if code not in codes]
+
+
+def ingest(years, levels, root=STORE_DIR, force=False, ttl=STORE_TTL, figures=False):
+    '''
+    This function fetches, cleans, and stores the ACS data for each year and geography level that is missing or
+    stale in the store (or all of them with force=True). Years are fetched concurrently and a partition is only
+    rewritten when its data changed. With figures=True the app's state level figures are also built ahead of time.
+    '''
+    todo = [(year, level) for year in years for level in levels] if force else stale_partitions(years, levels, root, ttl)
+    if not todo:
+        print("Store is up to date")
+    manifest = read_manifest(root)
+    # All years share one connection pool and rate limiter, so together they stay within CENSUS_MAX_WORKERS
+    # connections and CENSUS_REQUESTS_PER_SECOND
+    limiter = RateLimiter()
+    with make_session(MAX_WORKERS) as session, ThreadPoolExecutor(max_workers=YEAR_WORKERS) as pool:
+        # Check which variables each vintage publishes once per year rather than once per level
+        todo_years = sorted({year for year, _ in todo})
+        codes = dict(zip(todo_years, pool.map(lambda year: vintage_variables(year, session, limiter), todo_years)))
+        futures = {pool.submit(_build, year, level, codes[year], session, limiter): (year, level)
+                   for year, level in todo}
+        for future in as_completed(futures):
+            year, level = futures[future]
+            census_df, missing = future.result()
+            digest = census_df.attrs["digest"]
+            old_digest = manifest.get(str(year), {}).get(level, {}).get("digest")
+            if has_data(year, level, root) and old_digest == digest:
+                print("No changes to {} level data for {}".format(level, year))
+            else:
+                write_partition(census_df, year, level, root)
+                print("Stored {} {} level rows for {}".format(len(census_df), level, year))
+                if old_digest:
+                    shutil.rmtree(os.path.join(root, "figures", old_digest), ignore_errors=True)
+            _update_manifest(year, level, {"fetched_at": time.time(), "digest": digest, "rows": len(census_df),
+                                           "missing": missing}, root)
+
+    # Build the figures for any stored state level data that doesn't have them yet
+    if figures:
+        manifest = read_manifest(root)
+        for year in years:
+            digest = manifest.get(str(year), {}).get("state", {}).get("digest")
+            if digest and not os.path.isdir(os.path.join(root, "figures", digest)):
+                census_df = load_columns(year, "state", root=root).sort_values("id")
+                precompute_figures(census_df, digest, os.path.join(root, "figures"))
+                print("Built figures for {}".format(year))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch ACS data and write it to the local columnar store.")
+    parser.add_argument("--years", type=int, nargs="+", default=ACS5_YEARS)
+    parser.add_argument("--levels", nargs="+", default=["state"], choices=GEOGRAPHY_LEVELS)
+    parser.add_argument("--root", default=STORE_DIR)
+    parser.add_argument("--force", action="store_true", help="refetch data even if it is up to date")
+    parser.add_argument("--figures", action="store_true", help="build the app's figures ahead of time")
+    args = parser.parse_args()
+    ingest(args.years, args.levels, args.root, args.force, figures=args.figures)
+
+
+if __name__ == "__main__":
+    main()
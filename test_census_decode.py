@@ -0,0 +1,32 @@
+# Regression checks for census_decode (run with python -m pytest)
+import io
+import json
+
+import numpy as np
+import pytest
+
+from census_decode import BATCH_ROWS, decode_response
+
+
+def _body(n, missing):
+    # A response with n rows where only the rows in missing hold an ACS sentinel
+    rows = [["B01001_001E", "state"]]
+    rows += [["-666666666" if i in missing else str(i + 100), "%02d" % (i % 50)] for i in range(n)]
+    return ("[" + ",\n".join(json.dumps(row) for row in rows) + "]").encode()
+
+
+def test_missing_values_across_batches_and_growth():
+    n = 2 * BATCH_ROWS + 1809
+    body = _body(n, {0, BATCH_ROWS + 3})
+    for source in (body, io.BytesIO(body)):
+        columns = decode_response(source, categorical=["state"], size_hint=None if isinstance(source, bytes) else 1)
+        pop = columns["B01001_001E"]
+        assert np.flatnonzero(pop.isna()).tolist() == [0, BATCH_ROWS + 3]
+        assert pop[n - 1] == n - 1 + 100
+        assert list(columns["state"][-3:]) == ["%02d" % (i % 50) for i in range(n - 3, n)]
+
+
+def test_empty_response():
+    for body in (b"", b"[]", io.BytesIO(b"")):
+        with pytest.raises(ValueError, match="empty"):
+            decode_response(body)
@@ -0,0 +1,49 @@
+# Regression checks for census_stats (run with python -m pytest)
+import numpy as np
+import pandas as pd
+
+from census_stats import relationship_stats
+
+
+def _frame(n=200, seed=0):
+    # Percentages with ties, a different set of missing rows in each column, and missing SNAP rates
+    rng = np.random.default_rng(seed)
+    fpl = rng.uniform(0, 40, n).round()
+    df = pd.DataFrame({"fpl_pct": fpl, "unemp_pct": rng.uniform(0, 15, n),
+                       "snap_pct": 2 + 0.5 * fpl + rng.normal(0, 3, n), "pop": rng.lognormal(10, 1, n)})
+    df.loc[::7, "fpl_pct"] = np.nan
+    df.loc[::11, "unemp_pct"] = np.nan
+    df.loc[::13, "snap_pct"] = np.nan
+    return df
+
+
+def _weighted_corr(x, y, w):
+    cov = np.cov(x, y, aweights=w)
+    return cov[0, 1] / np.sqrt(cov[0, 0] * cov[1, 1])
+
+
+def test_relationship_stats_match_fits_on_each_pair():
+    df = _frame()
+    stats = relationship_stats(df)
+    assert list(stats.index) == ["fpl_pct", "unemp_pct"]
+    for var in stats.index:
+        pair = df[[var, "snap_pct", "pop"]].dropna()
+        x, y, w = pair[var].to_numpy(), pair["snap_pct"].to_numpy(), pair["pop"].to_numpy()
+        fit = stats.loc[var]
+        assert fit["n"] == len(pair)
+
+        slope, intercept = np.polyfit(x, y, 1)
+        assert np.isclose(fit["slope"], slope) and np.isclose(fit["intercept"], intercept)
+        assert np.isclose(fit["r"], np.corrcoef(x, y)[0, 1])
+        assert np.isclose(fit["r2"], fit["r"] ** 2)
+
+        # Closed form weighted least squares: ordinary least squares on rows scaled by the square root of the weight
+        design = np.column_stack([np.ones_like(x), x]) * np.sqrt(w)[:, None]
+        w_intercept, w_slope = np.linalg.lstsq(design, y * np.sqrt(w), rcond=None)[0]
+        assert np.isclose(fit["weighted_slope"], w_slope) and np.isclose(fit["weighted_intercept"], w_intercept)
+        assert np.isclose(fit["weighted_r"], _weighted_corr(x, y, w))
+
+        # Spearman's rho is Pearson's r of the ranks (ties get their average rank) within the pair
+        x_ranks, y_ranks = pair[var].rank().to_numpy(), pair["snap_pct"].rank().to_numpy()
+        assert np.isclose(fit["spearman"], np.corrcoef(x_ranks, y_ranks)[0, 1])
+        assert np.isclose(fit["weighted_spearman"], _weighted_corr(x_ranks, y_ranks, w))